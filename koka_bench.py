@@ -0,0 +1,311 @@
+"""
+こうかとん無双をウィンドウなし（SDLのdummyドライバ）で実行し，
+フレーム処理性能を計測するベンチマーク
+乱数のシードとマウス操作をスクリプトで固定するので，同じ条件なら同じ展開になる
+使い方：python koka_bench.py [small] [medium] [stress] [--frames N] [--seed S] [--engine] [--render]
+        python koka_bench.py --background [--frames N]（背景の転送速度の比較）
+        python koka_bench.py --ecs [--frames N]（スプライトとECSのエンティティのメモリ・更新と描画の速度の比較）
+        python koka_bench.py --soak [--frames N] [--memory mem.csv]（長時間実行でのメモリの増加の検出）
+"""
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # pygameの初期化より前に設定する
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+import argparse
+import gc
+import math
+import random
+import sys
+import time
+import tracemalloc
+import pygame as pg
+import koka_survivor as ks
+
+
+# シナリオ名と実行条件の辞書
+# enemies：開始時に配置しておく敵機の数，invincible：被弾してもゲームオーバーにしないか
+SCENARIOS = {
+    "small": {"frames": 3000, "enemies": 0, "invincible": False},
+    "medium": {"frames": 1000, "enemies": 1000, "invincible": True},
+    "stress": {"frames": 200, "enemies": 10000, "invincible": True},
+}
+
+
+def circle_policy(frame: int, game: ks.Game) -> tuple[int, int]:
+    """
+    画面中央のまわりを円を描くようにマウスを動かす操作スクリプト
+    引数1 frame：経過フレーム数
+    引数2 game：実行中のゲーム
+    戻り値：マウスの位置座標タプル
+    """
+    theta = 2 * math.pi * frame / 400
+    return int(ks.WIDTH/2 + 200*math.cos(theta)), int(ks.HEIGHT/2 + 150*math.sin(theta))
+
+
+def setup_headless() -> pg.Surface:
+    """
+    ヘッドレス実行のためにpygameを初期化し，画像を読み込む
+    戻り値：描画先の画面Surface
+    """
+    if not pg.get_init():
+        pg.init()
+    screen = pg.display.get_surface()
+    if screen is None:
+        screen = pg.display.set_mode((ks.WIDTH, ks.HEIGHT))
+    if not ks.Assets.surfaces:
+        ks.Assets.load_all()
+    return screen
+
+
+def run_headless(frames: int, seed: int = 0, policy=circle_policy, enemies: int = 0,
+                 invincible: bool = False, use_engine: bool = False, render: bool = False,
+                 sample_every: int = 50, trace_path: str | None = None, setup=None,
+                 telemetry: ks.MemoryTelemetry | None = None) -> dict:
+    """
+    フレームレートの制限なしでゲームをframesフレーム進め，計測結果を返す
+    引数1 frames：実行する最大フレーム数（こうかとんがやられたらその時点で終了）
+    引数2 seed：乱数のシード
+    引数3 policy：(frame, game)を受け取りマウス座標を返す操作スクリプト
+    引数4 enemies：開始時に配置しておく敵機の数
+    引数5 invincible：Trueなら被弾してもゲームオーバーにしない
+    引数6 use_engine：Trueなら移動計算にMotionEngineを使う
+    引数7 render：Trueなら描画も行う（Falseならロジックのみ）
+    引数8 sample_every：スプライト数を記録する間隔[フレーム]
+    引数9 trace_path：フレームごとのトレースの出力先（Noneなら出力しない）
+    引数10 setup：開始前にgameを受け取ってルールを書き換える関数（Noneなら何もしない）
+    引数11 telemetry：メモリの時系列を記録するMemoryTelemetry（Noneなら記録しない）
+    戻り値：fps，フェーズごとの平均時間[ms]，スプライト数・スコア・レベルの推移などの辞書
+    """
+    screen = setup_headless()
+    random.seed(seed)
+    game = ks.Game(screen, use_engine=use_engine, render=render)
+    game.invincible = invincible
+    if setup is not None:
+        setup(game)
+    game.waves.spawn(enemies)
+
+    profiler = ks.FrameProfiler(trace_path=trace_path) if trace_path is not None else None
+    phase_ms: dict[str, float] = {}
+    samples = []
+    survived = True
+    start = time.perf_counter()
+    frame = 0
+    while frame < frames:
+        frame_start = time.perf_counter()
+        survived = game.step(policy(frame, game), [])
+        if profiler is not None:
+            profiler.record(game.tmr, game.timer.times, game.counts(), (time.perf_counter() - frame_start) * 1000)
+        for name, ms in game.timer.times.items():
+            phase_ms[name] = phase_ms.get(name, 0.0) + ms
+        frame += 1
+        if telemetry is not None:
+            telemetry.update(game.tmr, game)
+        if frame % sample_every == 0:
+            samples.append((frame, {**game.counts(), "score": game.score.value, "level": game.bird.level}))
+        if not survived:
+            break
+    elapsed = time.perf_counter() - start
+    if profiler is not None:
+        profiler.close()
+    return {
+        "frames": frame,
+        "seconds": elapsed,
+        "fps": frame / elapsed if elapsed > 0 else float("inf"),
+        "phase_ms": {name: ms / frame for name, ms in phase_ms.items()},
+        "samples": samples,
+        "pools": game.pool_stats(),
+        "score": game.score.value,
+        "level": game.bird.level,
+        "survived": survived,
+    }
+
+
+def bench_background(iterations: int = 500) -> dict[str, float]:
+    """
+    背景の描き直し1回あたりの時間を，以前の方式とBackgroundで比較する
+    引数 iterations：計測する回数
+    戻り値：方式の名前と1回あたりの時間[ms]の辞書
+    """
+    screen = setup_headless()
+    raw = pg.image.load(os.path.join("fig", "aozora.jpg"))  # 以前の方式：convert()していない画像を0.7倍にしたもの
+    raw = pg.transform.scale(raw, (int(raw.get_width() * 0.7), int(raw.get_height() * 0.7)))
+    converted = ks.Assets.get("aozora")
+    converted = pg.transform.scale(converted, (int(converted.get_width() * 0.7), int(converted.get_height() * 0.7)))
+    background = ks.Background()
+    scrolling = ks.Background(mode="tile", scroll=(-2, 0), tile_scale=0.7)
+    rect = pg.Rect(500, 300, 120, 120)  # スプライト1体分の消去
+
+    def full_blit(img):
+        return lambda: screen.blit(img, (0, 0))
+
+    def scroll():
+        scrolling.update()
+        scrolling.restore(screen)
+
+    cases = {
+        "raw 0.7x full": full_blit(raw),
+        "converted 0.7x full": full_blit(converted),
+        "Background full": lambda: background.restore(screen),
+        "Background 120px rect": lambda: background.restore(screen, rect),
+        "Background scroll": scroll,
+    }
+    result = {}
+    for name, blit in cases.items():
+        blit()  # 初回の準備を計測から外す
+        start = time.perf_counter()
+        for _ in range(iterations):
+            blit()
+        result[name] = (time.perf_counter() - start) * 1000 / iterations
+    return result
+
+
+class SpriteExplosion(pg.sprite.Sprite):
+    """
+    比較用：ECSに移す前の，pg.sprite.Spriteのサブクラスとしての爆発
+    """
+    def __init__(self, center: tuple[int, int], life: int):
+        super().__init__()
+        self.imgs = [ks.Assets.get("explosion"), ks.Assets.flipped("explosion", True, True)]
+        self.image = self.imgs[0]
+        self.rect = self.image.get_rect(center=center)
+        self.life = life
+
+    def update(self):
+        self.life -= 1
+        self.image = self.imgs[self.life//10%2]
+        if self.life < 0:
+            self.kill()
+
+
+def bench_ecs(count: int = 10000, passes: int = 50) -> dict[str, dict[str, float]]:
+    """
+    同じ数の爆発を，スプライトとECSのエンティティで作ったときの
+    1体あたりのメモリと，1回の更新にかかる時間を比較する
+    更新は寿命の減算・画像の選択・screen.blitsに渡すリストの作成までとし（ECSは画像の選択をAppearanceSystem.sequenceで行う），
+    どちらも同じ数の同じ画像を送る転送（screen.blits）は別に計る
+    引数1 count：作る数
+    引数2 passes：計測する更新の回数
+    戻り値：方式の名前と{"bytes/entity"：1体あたりのメモリ[byte]，"ms/pass"：1回の更新の時間[ms]，"blit ms/pass"：1回の転送の時間[ms]}の辞書
+    """
+    screen = setup_headless()
+    life = passes * 10  # 計測中に寿命が尽きないようにする
+
+    def build_sprites():
+        group = pg.sprite.Group()
+        for i in range(count):
+            group.add(SpriteExplosion((i % ks.WIDTH, i % ks.HEIGHT), life))
+        return group
+
+    def build_world():
+        world = ks.World()
+        appearance = ks.Appearance([ks.Assets.get("explosion"), ks.Assets.flipped("explosion", True, True)])
+        for i in range(count):
+            world.create(ks.Position(i % ks.WIDTH, i % ks.HEIGHT), ks.Lifetime(life), appearance)
+        return world
+
+    def update_sprites(group):
+        group.update()
+        return [(sprite.image, sprite.rect) for sprite in group]  # DirtyRenderer.blit_groupと同じ転送
+
+    def update_world(world):
+        ks.LifetimeSystem.run(world)
+        return ks.AppearanceSystem.sequence(world)
+
+    result = {}
+    for name, build, update in (("pg.sprite.Sprite", build_sprites, update_sprites),
+                                ("ECS", build_world, update_world)):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        target = build()
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        gc.collect()  # 前の方式で作ったもの（循環参照のスプライトとグループ）をgcの対象から外す
+        update_s = blit_s = 0.0
+        for _ in range(passes):
+            start = time.perf_counter()
+            seq = update(target)
+            middle = time.perf_counter()
+            screen.blits(seq)
+            update_s += middle - start
+            blit_s += time.perf_counter() - middle
+        result[name] = {"bytes/entity": used / count, "ms/pass": update_s * 1000 / passes, "blit ms/pass": blit_s * 1000 / passes}
+    return result
+
+
+def soak(frames: int = 30000, seed: int = 0, memory_path: str | None = None, every: int = 1000) -> bool:
+    """
+    無敵のこうかとんで描画も含めて長時間ゲームを進め，メモリの増え方を記録して増え続けている項目を報告する
+    引数1 frames：実行するフレーム数
+    引数2 seed：乱数のシード
+    引数3 memory_path：メモリの時系列の出力先（Noneなら出力しない）
+    引数4 every：記録する間隔[フレーム]
+    戻り値：増え続けている項目が無ければTrue
+    """
+    telemetry = ks.MemoryTelemetry(memory_path, interval=every)
+    try:
+        result = run_headless(frames, seed=seed, invincible=True, render=True, sample_every=frames, telemetry=telemetry)
+        print(f"== soak: {result['frames']} frames in {result['seconds']:.2f} s (score {result['score']}, level {result['level']})")
+        print(telemetry.report())
+        return not telemetry.growth()
+    finally:
+        telemetry.close()
+
+
+def print_result(name: str, result: dict):
+    """
+    計測結果を表示する
+    引数1 name：シナリオ名
+    引数2 result：run_headless()の戻り値
+    """
+    print(f"== {name}: {result['frames']} frames in {result['seconds']:.2f} s "
+          f"-> {result['fps']:.1f} frames/s (score {result['score']}, level {result['level']}, "
+          f"{'survived' if result['survived'] else 'game over'})")
+    for phase, ms in result["phase_ms"].items():
+        print(f"   {phase:<10}{ms:>9.3f} ms/frame")
+    for pool, stats in result["pools"].items():
+        print(f"   pool {pool:<10}" + " ".join(f"{k}={v}" for k, v in stats.items()))
+    for frame, counts in result["samples"]:
+        print(f"   frame {frame:>6}: " + " ".join(f"{k}={v}" for k, v in counts.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="こうかとん無双のヘッドレスベンチマーク")
+    parser.add_argument("scenarios", nargs="*", help=f"実行するシナリオ（{', '.join(SCENARIOS)}，省略時はすべて）")
+    parser.add_argument("--frames", type=int, help="シナリオのフレーム数を上書きする")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", action="store_true", help="MotionEngine（NumPy）を使う")
+    parser.add_argument("--render", action="store_true", help="描画処理も計測に含める")
+    parser.add_argument("--sample-every", type=int, default=50)
+    parser.add_argument("--trace", help="フレームごとのトレースの出力先（{scenario}を置換，.jsonlならJSON Lines）")
+    parser.add_argument("--background", action="store_true", help="シナリオの代わりに背景の転送速度を比較する")
+    parser.add_argument("--ecs", action="store_true", help="シナリオの代わりにスプライトとECSのエンティティを比較する（--framesで数を指定）")
+    parser.add_argument("--soak", action="store_true", help="シナリオの代わりに長時間実行してメモリの増加を調べる（増え続けていれば終了コード1）")
+    parser.add_argument("--memory", help="--soakのメモリの時系列の出力先（.jsonlならJSON Lines）")
+    parser.add_argument("--memory-every", type=int, default=1000, help="--soakでメモリを記録する間隔[フレーム]")
+    args = parser.parse_args()
+    if args.soak:
+        if not soak(args.frames or 30000, args.seed, args.memory, args.memory_every):
+            sys.exit(1)
+        return
+    if args.ecs:
+        for name, stats in bench_ecs(args.frames or 10000).items():
+            print(f"   {name:<18}{stats['bytes/entity']:>9.1f} bytes/entity{stats['ms/pass']:>9.3f} ms/pass (blit {stats['blit ms/pass']:.3f} ms)")
+        return
+    if args.background:
+        for name, ms in bench_background(args.frames or 500).items():
+            print(f"   {name:<24}{ms:>9.3f} ms/blit")
+        return
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"未知のシナリオ：{name}")
+    for name in args.scenarios or list(SCENARIOS):
+        scenario = dict(SCENARIOS[name])
+        if args.frames is not None:
+            scenario["frames"] = args.frames
+        trace_path = args.trace.replace("{scenario}", name) if args.trace else None
+        result = run_headless(seed=args.seed, use_engine=args.engine, render=args.render,
+                              sample_every=args.sample_every, trace_path=trace_path, **scenario)
+        print_result(name, result)
+
+
+if __name__ == "__main__":
+    main()
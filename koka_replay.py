@@ -0,0 +1,89 @@
+"""
+KOKA_RECORDで記録した入力を再生し，プレイ中と同じシミュレーションを再現するツール
+既定ではウィンドウなしで可能な限り速く再生し，--realtimeでウィンドウに描画しながら実時間で再生する
+使い方：python koka_replay.py run.koka [--realtime] [--trace trace.csv]
+"""
+import os
+import sys
+if "--realtime" not in sys.argv:  # ウィンドウなしで再生するときは，pygameの初期化より前にdummyドライバを設定する
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+import argparse
+import random
+import time
+import pygame as pg
+import koka_survivor as ks
+
+
+def replay(path: str, realtime: bool = False, trace_path: str | None = None) -> dict:
+    """
+    記録ファイルの入力でゲームを最初から進め直す
+    引数1 path：記録ファイルのパス
+    引数2 realtime：Trueなら描画しながらFPS回/秒で再生し，Falseなら描画せずに最速で再生する
+    引数3 trace_path：更新ごとのトレースの出力先（Noneなら出力しない）
+    戻り値：再生した更新回数，かかった時間，最終スコア・レベルなどの辞書
+    """
+    player = ks.InputPlayer(path)
+    if not pg.get_init():
+        pg.init()
+    screen = pg.display.get_surface() or pg.display.set_mode((ks.WIDTH, ks.HEIGHT))
+    if not ks.Assets.surfaces:
+        ks.Assets.load_all()
+    random.seed(player.seed)  # main()と同じ順序でシードを設定してからGameを作る
+    game = ks.Game(screen, use_engine=player.use_engine, render=realtime, separation=player.separation)
+    profiler = ks.FrameProfiler(trace_path=trace_path)
+    clock = pg.time.Clock()
+    quality = 0
+    alive = True
+    start = time.perf_counter()
+    try:
+        for i in range(len(player)):
+            tick_start = time.perf_counter()
+            mouse_pos, events, level = player.tick(i)
+            if level != quality:  # 記録時と同じタイミングで描画品質を切り替える
+                game.set_quality(ks.QUALITY_LEVELS[level])
+                quality = level
+            game.timer.start()
+            alive = game.update(mouse_pos, events)
+            if realtime:
+                if any(event.type == pg.QUIT for event in pg.event.get()):
+                    break
+                game.render_frame()
+                dirty = game.renderer.flush()
+                if dirty is None:
+                    pg.display.update()
+                else:
+                    pg.display.update(dirty)
+            if profiler.active:
+                profiler.record(i, game.timer.times, game.counts(), (time.perf_counter() - tick_start) * 1000)
+            if not alive:
+                break
+            if realtime:
+                clock.tick(ks.FPS)
+    finally:
+        profiler.close()
+    elapsed = time.perf_counter() - start
+    return {
+        "ticks": game.tmr,
+        "recorded": len(player),
+        "seconds": elapsed,
+        "score": game.score.value,
+        "level": game.bird.level,
+        "survived": alive,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="こうかとん無双の入力記録の再生")
+    parser.add_argument("path", help="KOKA_RECORDで記録したファイル")
+    parser.add_argument("--realtime", action="store_true", help="ウィンドウに描画しながら実時間で再生する")
+    parser.add_argument("--trace", help="更新ごとのトレースの出力先（.jsonlならJSON Lines）")
+    args = parser.parse_args()
+    result = replay(args.path, args.realtime, args.trace)
+    print(f"{result['ticks']}/{result['recorded']} ticks in {result['seconds']:.2f} s "
+          f"-> {result['ticks'] / max(result['seconds'], 1e-9):.1f} ticks/s "
+          f"(score {result['score']}, level {result['level']}, {'survived' if result['survived'] else 'game over'})")
+
+
+if __name__ == "__main__":
+    main()
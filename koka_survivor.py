@@ -1,15 +1,58 @@
+import csv
+import gc
+import inspect
+import json
 import math
 import os
+import queue
 import random
+import sqlite3
+import struct
 import sys
+import threading
 import time
+import tracemalloc
+from array import array
+from collections import deque
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pygame as pg
 import pygame
+try:
+    import numpy as np
+except ImportError:  # NumPyが無い環境ではMotionEngineを使わず（敵機はFlowFieldで動かす），ECSのシステムは1体ずつ計算する
+    np = None
 
 
 
+LAUNCH_TIME = time.perf_counter()  # 起動時刻（最初のフレームまでの時間の計測用）
 WIDTH = 1100  # ゲームウィンドウの幅
 HEIGHT = 650  # ゲームウィンドウの高さ
+FPS = 50  # シミュレーションの1秒あたりの更新回数（速度・寿命・出現間隔はこの更新回数が単位）
+MAX_TICKS = 5  # 1描画フレームで進めるシミュレーションの最大回数（処理落ち時に追いつこうとして固まるのを防ぐ）
+ROTATION_STEP = 5  # 回転キャッシュの角度の刻み幅[度]（1で1°刻み，45で8方向）
+# 敵機の出現ウェーブの表（上から順に難しくなる）
+# こうかとんのレベルがlevel以上か，開始からafter秒以上たった行のうち，最も下の行を使う
+# interval：出現間隔[更新回数]，batch：1回に出現させる数，mix：敵機の画像名と出現比率，
+# speed：敵機の速さ，cap：同時に存在できる敵機の上限（1フレームの処理時間の予算に収まる数）
+WAVES = [
+    {"level": 1, "after": 0, "interval": 100, "batch": 1, "mix": {"enemy1": 1, "enemy2": 1, "enemy3": 1}, "speed": 4, "cap": 40},
+    {"level": 2, "after": 60, "interval": 80, "batch": 2, "mix": {"enemy1": 2, "enemy2": 2, "enemy3": 1}, "speed": 4, "cap": 80},
+    {"level": 3, "after": 120, "interval": 60, "batch": 3, "mix": {"enemy1": 1, "enemy2": 2, "enemy3": 2}, "speed": 5, "cap": 150},
+    {"level": 5, "after": 240, "interval": 50, "batch": 5, "mix": {"enemy1": 1, "enemy2": 1, "enemy3": 3}, "speed": 5, "cap": 300},
+]
+# 回転刃の枚数の表：(こうかとんのレベル, 枚数)のリストで，レベル以上になった行のうち最も下の行の枚数にする
+BLADE_LEVELS = [(1, 1), (5, 2), (15, 3), (30, 4), (60, 6)]
+# 処理が重いときに段階的に下げる描画品質の表（上から順に軽くなる）
+# rotation_step：回転画像の角度の刻み幅[度]，animate_explosions：爆発画像を切り替えるか，
+# max_explosions：同時に表示する爆発の上限（Noneなら無制限），blade_stride：回転刃を何枚おきに描画するか
+QUALITY_LEVELS = [
+    {"rotation_step": ROTATION_STEP, "animate_explosions": True, "max_explosions": None, "blade_stride": 1},
+    {"rotation_step": 15, "animate_explosions": True, "max_explosions": None, "blade_stride": 1},
+    {"rotation_step": 15, "animate_explosions": False, "max_explosions": None, "blade_stride": 1},
+    {"rotation_step": 15, "animate_explosions": False, "max_explosions": 64, "blade_stride": 1},
+    {"rotation_step": 45, "animate_explosions": False, "max_explosions": 32, "blade_stride": 2},
+]
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 
@@ -39,6 +82,936 @@ def calc_orientation(org: pg.Rect, dst: pg.Rect) -> tuple[float, float]:
     return x_diff/norm, y_diff/norm
 
 
+def circle_rect_collide(center: tuple[float, float], radius: float, rct: pg.Rect) -> bool:
+    """
+    円とRectが重なっているかを判定する
+    引数1 center：円の中心座標
+    引数2 radius：円の半径
+    引数3 rct：判定するRect
+    戻り値：重なっていればTrue
+    """
+    # Rect内で円の中心に最も近い点までの距離で判定する
+    dx = center[0] - max(rct.left, min(center[0], rct.right))
+    dy = center[1] - max(rct.top, min(center[1], rct.bottom))
+    return dx*dx + dy*dy <= radius*radius
+
+
+def segment_rect_collide(start: tuple[float, float], end: tuple[float, float], half_width: float, rct: pg.Rect) -> bool:
+    """
+    太さのある線分（両端が丸い帯）とRectが重なっているかを判定する
+    引数1 start：線分の始点
+    引数2 end：線分の終点
+    引数3 half_width：帯の太さの半分
+    引数4 rct：判定するRect
+    戻り値：重なっていればTrue
+    """
+    if rct.clipline(start, end):  # 線分がRectを通っている
+        return True
+    # 交わらないときの最短距離は，線分の端点とRectの間か，Rectの角と線分の間のどちらかになる
+    if circle_rect_collide(start, half_width, rct) or circle_rect_collide(end, half_width, rct):
+        return True
+    sx, sy = end[0] - start[0], end[1] - start[1]
+    length2 = sx*sx + sy*sy
+    if length2 == 0:
+        return False
+    for px, py in (rct.topleft, rct.topright, rct.bottomleft, rct.bottomright):
+        t = max(0.0, min(1.0, ((px - start[0])*sx + (py - start[1])*sy) / length2))
+        dx, dy = px - (start[0] + t*sx), py - (start[1] + t*sy)
+        if dx*dx + dy*dy <= half_width*half_width:
+            return True
+    return False
+
+
+class Assets:
+    """
+    fig/以下の画像を起動時に一括で読み込み，共有Surfaceとして貸し出すクラス
+    ゲームループ中にファイルI/OやPNGデコードが発生しないようにする
+    """
+    surfaces: dict[str, pg.Surface] = {}  # 画像名（拡張子なし）と表示形式に変換済みSurfaceの辞書
+    derived: dict[object, pg.Surface] = {}  # 反転などで加工したSurfaceのキャッシュ
+    stats: dict[str, tuple[float, int]] = {}  # 画像名と（読み込み時間[ms]，メモリ使用量[byte]）の辞書
+
+    @staticmethod
+    def decode(path: str) -> tuple[pg.Surface, float]:
+        """
+        画像ファイルを読み込んでデコードする（ワーカースレッドで呼ばれる）
+        引数 path：画像ファイルのパス
+        戻り値：デコードしたSurfaceと，かかった時間[ms]のタプル
+        """
+        start = time.perf_counter()
+        img = pg.image.load(path)
+        return img, (time.perf_counter() - start) * 1000
+
+    @classmethod
+    def load_all(cls, directory: str = "fig", workers: int | None = None, progress=None):
+        """
+        ディレクトリ内の画像をすべて読み込み，表示形式に変換して登録する
+        ファイルの読み込みとデコードはスレッドプールで並列に行い，表示形式への変換はメインスレッドで行う
+        pg.display.set_mode()の後に呼び出すこと
+        引数1 directory：画像ディレクトリのパス
+        引数2 workers：デコードに使うスレッド数（Noneなら自動）
+        引数3 progress：1枚登録するごとに(登録済みの数, 全体の数, 画像名)で呼ぶ関数（Noneなら呼ばない）
+        """
+        files = {}
+        for filename in sorted(os.listdir(directory)):
+            name, ext = os.path.splitext(filename)
+            if ext.lower() in (".png", ".gif", ".jpg", ".jpeg", ".bmp"):
+                files[name] = (os.path.join(directory, filename), ext.lower())
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(cls.decode, path): name for name, (path, _) in files.items()}
+            for done, future in enumerate(as_completed(futures), 1):
+                name = futures[future]
+                img, elapsed = future.result()
+                start = time.perf_counter()
+                if files[name][1] in (".jpg", ".jpeg"):  # 透過のない写真はconvert()
+                    img = img.convert()
+                else:  # 透過・カラーキー付きの画像はconvert_alpha()
+                    img = img.convert_alpha()
+                elapsed += (time.perf_counter() - start) * 1000
+                cls.surfaces[name] = img
+                cls.stats[name] = (elapsed, img.get_pitch() * img.get_height())
+                if progress is not None:
+                    progress(done, len(files), name)
+        cls.stats = dict(sorted(cls.stats.items()))  # レポートは画像名の順に表示する
+
+    @classmethod
+    def get(cls, name: str) -> pg.Surface:
+        """
+        登録済みの共有Surfaceを返す
+        返されたSurfaceは共有物なので，書き換えずに使うこと
+        引数 name：画像名（拡張子なし，例："beam"，"3"）
+        戻り値：画像Surface
+        """
+        return cls.surfaces[name]
+
+    @classmethod
+    def flipped(cls, name: str, flip_x: bool, flip_y: bool) -> pg.Surface:
+        """
+        反転させた共有Surfaceを返す（初回のみ生成し，以降はキャッシュを返す）
+        引数1 name：画像名
+        引数2 flip_x：左右反転するか
+        引数3 flip_y：上下反転するか
+        戻り値：反転後のSurface
+        """
+        key = ("flip", name, flip_x, flip_y)
+        if key not in cls.derived:
+            cls.derived[key] = pg.transform.flip(cls.get(name), flip_x, flip_y)
+        return cls.derived[key]
+
+    @classmethod
+    def rotated(cls, name: str, angle: int) -> pg.Surface:
+        """
+        固定角度で回転させた共有Surfaceを返す（初回のみ生成し，以降はキャッシュを返す）
+        引数1 name：画像名
+        引数2 angle：回転角度[度]
+        戻り値：回転後のSurface
+        """
+        key = ("rotate", name, angle)
+        if key not in cls.derived:
+            cls.derived[key] = pg.transform.rotate(cls.get(name), angle)
+        return cls.derived[key]
+
+    @classmethod
+    def rotations(cls, name: str, scale: float = 1.0, smooth: bool = True, flip_x: bool = False) -> "RotationCache":
+        """
+        画像ごとに共有される回転キャッシュを返す
+        引数1 name：画像名
+        引数2 scale：拡大率
+        引数3 smooth：Trueならrotozoom（補間あり），Falseならrotate
+        引数4 flip_x：左右反転した画像を回転させるか
+        戻り値：RotationCacheインスタンス
+        """
+        key = ("rotations", name, scale, smooth, flip_x)
+        if key not in cls.derived:
+            img = cls.flipped(name, True, False) if flip_x else cls.get(name)
+            cls.derived[key] = RotationCache(img, scale=scale, smooth=smooth)
+        return cls.derived[key]
+
+    @classmethod
+    def report(cls) -> str:
+        """
+        画像ごとの読み込み時間とメモリ使用量を表形式の文字列で返す
+        戻り値：レポート文字列
+        """
+        lines = [f"{'asset':<12}{'load[ms]':>10}{'memory[KB]':>12}"]
+        for name, (elapsed, nbytes) in cls.stats.items():
+            lines.append(f"{name:<12}{elapsed:>10.2f}{nbytes/1024:>12.1f}")
+        total_ms = sum(elapsed for elapsed, _ in cls.stats.values())
+        total_kb = sum(nbytes for _, nbytes in cls.stats.values()) / 1024
+        lines.append(f"{'total':<12}{total_ms:>10.2f}{total_kb:>12.1f}")
+        return "\n".join(lines)
+
+
+class RotationCache:
+    """
+    画像を量子化した角度ごとに回転させ，結果をキャッシュするクラス
+    各角度のSurfaceは初めて必要になったときに一度だけ生成する
+    """
+    def __init__(self, image: pg.Surface, step: float | None = None, scale: float = 1.0, smooth: bool = True):
+        """
+        引数1 image：回転元の画像Surface
+        引数2 step：角度の刻み幅[度]（Noneならモジュール定数ROTATION_STEP）
+        引数3 scale：拡大率
+        引数4 smooth：Trueならrotozoom（補間あり），Falseならrotate
+        """
+        self.image = image
+        self.step = ROTATION_STEP if step is None else step
+        self.scale = scale
+        self.smooth = smooth
+        self.cache: dict[tuple[float, int], tuple[pg.Surface, tuple[int, int]]] = {}
+
+    def get(self, angle: float, step: float | None = None) -> tuple[pg.Surface, tuple[int, int]]:
+        """
+        角度を刻み幅に丸めた回転画像と，中心合わせ用のオフセットを返す
+        引数1 angle：回転角度[度]（反時計回り）
+        引数2 step：刻み幅[度]（Noneならself.step．描画品質を下げた描画だけが指定し，当たり判定には使わない）
+        戻り値：回転後のSurfaceと，中心座標に足すと左上座標になる(dx, dy)のタプル
+        """
+        step = self.step if step is None else step
+        idx = round(angle / step) % round(360 / step)
+        key = (step, idx)
+        if key not in self.cache:
+            if self.smooth:
+                img = pg.transform.rotozoom(self.image, idx * step, self.scale)
+            else:
+                src = self.image
+                if self.scale != 1.0:
+                    src = pg.transform.scale(src, (int(src.get_width() * self.scale), int(src.get_height() * self.scale)))
+                img = pg.transform.rotate(src, idx * step)
+            self.cache[key] = img, (-(img.get_width() // 2), -(img.get_height() // 2))
+        return self.cache[key]
+
+
+class SpatialHash:
+    """
+    一様グリッドによる衝突判定の広域探索（broadphase）クラス
+    グループごとのグリッドはフレームごとに一度だけ構築し，同じフレームの問い合わせで使い回す
+    pg.sprite.groupcollide/spritecollideと同じ結果・同じkill動作を返す
+    最近傍探索（自動照準やホーミング武器の目標選択）にも同じインスタンスを使う
+    """
+    def __init__(self, cell_size: int = 128):
+        """
+        引数 cell_size：グリッド1マスの一辺の長さ[px]
+        """
+        self.cell_size = cell_size
+        self.grids: dict[int, tuple[pg.sprite.AbstractGroup, dict[tuple[int, int], list[pg.sprite.Sprite]], dict[pg.sprite.Sprite, int]]] = {}
+        self.points: dict[int, tuple[pg.sprite.AbstractGroup, dict[tuple[int, int], list[pg.sprite.Sprite]], dict[pg.sprite.Sprite, int]]] = {}
+
+    def begin_frame(self):
+        """
+        前フレームのグリッドを破棄する（毎フレーム，スプライトの移動後・問い合わせ前に呼び出す）
+        """
+        self.grids.clear()
+        self.points.clear()
+
+    def cells(self, rect: pg.Rect):
+        """
+        Rectが重なるマスの座標を順に返す
+        引数 rect：対象のRect
+        """
+        cs = self.cell_size
+        for cx in range(rect.left // cs, max(rect.left, rect.right - 1) // cs + 1):
+            for cy in range(rect.top // cs, max(rect.top, rect.bottom - 1) // cs + 1):
+                yield cx, cy
+
+    def grid(self, group: pg.sprite.AbstractGroup) -> dict[tuple[int, int], list[pg.sprite.Sprite]]:
+        """
+        グループのグリッドを返す（このフレームで未構築なら構築する）
+        引数 group：スプライトグループ
+        戻り値：マス座標とそのマスに重なるスプライトのリストの辞書
+        """
+        return self.grid_entry(group)[1]
+
+    def grid_entry(self, group: pg.sprite.AbstractGroup) -> tuple[pg.sprite.AbstractGroup, dict[tuple[int, int], list[pg.sprite.Sprite]], dict[pg.sprite.Sprite, int]]:
+        """
+        グループのグリッドとグループ内の順番を返す（このフレームで未構築なら構築する）
+        引数 group：スプライトグループ
+        戻り値：グループ，マス座標とスプライトのリストの辞書，スプライトとグループ内の順番の辞書のタプル
+        """
+        entry = self.grids.get(id(group))
+        if entry is None:
+            cells: dict[tuple[int, int], list[pg.sprite.Sprite]] = {}
+            cs = self.cell_size
+            sprites = group.sprites()
+            order = {sprite: i for i, sprite in enumerate(sprites)}
+            for sprite in sprites:  # スプライト数が多いので，cells()を使わず展開して書く
+                left, top, width, height = sprite.rect
+                x0, y0 = left // cs, top // cs
+                x1, y1 = (left + max(width, 1) - 1) // cs, (top + max(height, 1) - 1) // cs
+                if x0 == x1 and y0 == y1:
+                    cells.setdefault((x0, y0), []).append(sprite)
+                    continue
+                for cx in range(x0, x1 + 1):
+                    for cy in range(y0, y1 + 1):
+                        cells.setdefault((cx, cy), []).append(sprite)
+            entry = self.grids[id(group)] = (group, cells, order)
+        return entry
+
+    def insert(self, group: pg.sprite.AbstractGroup, sprite: pg.sprite.Sprite):
+        """
+        構築済みのグリッドにスプライトを追加する（未構築なら何もしない）
+        フレームの途中でグループに追加したスプライトを同じフレームの判定に含めるために使う
+        引数1 group：スプライトを追加したグループ
+        引数2 sprite：追加したスプライト
+        """
+        entry = self.grids.get(id(group))
+        if entry is not None:
+            for cell in self.cells(sprite.rect):
+                entry[1].setdefault(cell, []).append(sprite)
+            self.append_order(entry[2], sprite)
+        points = self.points.get(id(group))
+        if points is not None:
+            points[1].setdefault(self.center_cell(sprite.rect), []).append(sprite)
+            self.append_order(points[2], sprite)
+
+    @staticmethod
+    def append_order(order: dict[pg.sprite.Sprite, int], sprite: pg.sprite.Sprite):
+        """
+        グループの末尾に追加されたスプライトに，既存のどれよりも後の順番を割り当てる
+        同じフレームでkillされて再利用されたスプライトは，古い順番を捨てて末尾に付け直す
+        引数1 order：スプライトとグループ内の順番の辞書
+        引数2 sprite：追加したスプライト
+        """
+        order.pop(sprite, None)
+        order[sprite] = order[next(reversed(order))] + 1 if order else 0
+
+    def add(self, group: pg.sprite.AbstractGroup, *sprites: pg.sprite.Sprite):
+        """
+        グループにスプライトを追加し，構築済みのグリッドにも反映する
+        引数1 group：追加先のグループ
+        引数2 sprites：追加するスプライト
+        """
+        for sprite in sprites:
+            group.add(sprite)
+            self.insert(group, sprite)
+
+    def center_cell(self, rect: pg.Rect) -> tuple[int, int]:
+        """
+        Rectの中心が属するマスの座標を返す
+        引数 rect：対象のRect
+        戻り値：マス座標のタプル
+        """
+        return rect.centerx // self.cell_size, rect.centery // self.cell_size
+
+    def point_grid(self, group: pg.sprite.AbstractGroup) -> tuple[dict[tuple[int, int], list[pg.sprite.Sprite]], dict[pg.sprite.Sprite, int]]:
+        """
+        スプライトの中心座標で振り分けたグリッドを返す（このフレームで未構築なら構築する）
+        引数 group：スプライトグループ
+        戻り値：マス座標とスプライトのリストの辞書，スプライトとグループ内の順番の辞書
+        """
+        entry = self.points.get(id(group))
+        if entry is None:
+            cells: dict[tuple[int, int], list[pg.sprite.Sprite]] = {}
+            order: dict[pg.sprite.Sprite, int] = {}
+            for sprite in group.sprites():
+                cells.setdefault(self.center_cell(sprite.rect), []).append(sprite)
+                order[sprite] = len(order)
+            entry = self.points[id(group)] = (group, cells, order)
+        return entry[1], entry[2]
+
+    def nearest(self, group: pg.sprite.AbstractGroup, pos: tuple[float, float], k: int | None = 1, radius: float | None = None) -> list[pg.sprite.Sprite]:
+        """
+        posに中心が近い順にgroup内のスプライトを返す
+        posのマスから外側へ1周ずつ探索し，k個が確定した時点で打ち切る
+        引数1 group：探索対象のグループ
+        引数2 pos：基準座標
+        引数3 k：返す最大数（Noneなら半径内のすべて）
+        引数4 radius：探索半径[px]（Noneなら無制限）
+        戻り値：近い順のスプライトのリスト（距離が同じならグループ内の順番が先のもの）
+        """
+        if k is None and radius is None:
+            raise ValueError("kとradiusの少なくとも一方を指定すること")
+        cells, order = self.point_grid(group)
+        if not cells:
+            return []
+        cs = self.cell_size
+        px, py = pos
+        cx, cy = int(px // cs), int(py // cs)
+        # 中身のあるマスをすべて覆うのに必要な周回数
+        max_ring = max(max(abs(x - cx), abs(y - cy)) for x, y in cells)
+        if radius is not None:
+            max_ring = min(max_ring, int(radius // cs) + 1)
+        found: list[tuple[float, int, pg.sprite.Sprite]] = []
+        seen: set[pg.sprite.Sprite] = set()  # 再利用されたスプライトは複数のマスに残っていることがある
+        for ring in range(max_ring + 1):
+            for x in range(cx - ring, cx + ring + 1):
+                for y in range(cy - ring, cy + ring + 1):
+                    if ring and cx - ring < x < cx + ring and cy - ring < y < cy + ring:
+                        continue  # 内側のマスは探索済み
+                    for sprite in cells.get((x, y), ()):
+                        if sprite in seen or sprite not in group:
+                            continue
+                        seen.add(sprite)
+                        dist2 = (sprite.rect.centerx - px)**2 + (sprite.rect.centery - py)**2
+                        if radius is None or dist2 <= radius**2:
+                            found.append((dist2, order[sprite], sprite))
+            # 未探索のマスにある中心は，少なくともring*csだけ離れている
+            if k is not None and len(found) >= k:
+                found.sort(key=lambda item: item[:2])
+                if found[k-1][0] <= (ring * cs)**2:
+                    break
+        found.sort(key=lambda item: item[:2])
+        return [sprite for _, _, sprite in found[:k]]
+
+    def query(self, rect: pg.Rect, group: pg.sprite.AbstractGroup) -> list[pg.sprite.Sprite]:
+        """
+        Rectと同じマスにいる，まだグループに属しているスプライトを返す（重なり判定前の候補）
+        引数1 rect：問い合わせるRect
+        引数2 group：探索対象のグループ
+        戻り値：候補スプライトのリスト（グループへの追加順を保った重複なしのリスト）
+        """
+        _, grid, order = self.grid_entry(group)
+        found: set[pg.sprite.Sprite] = set()
+        for cell in self.cells(rect):
+            found.update(grid.get(cell, ()))
+        # マスの走査順ではなく，pg.sprite.spritecollideと同じグループへの追加順に並べる
+        return sorted((sprite for sprite in found if sprite in group), key=order.__getitem__)
+
+    def spritecollide(self, sprite: pg.sprite.Sprite, group: pg.sprite.AbstractGroup, dokill: bool) -> list[pg.sprite.Sprite]:
+        """
+        pg.sprite.spritecollideと同じく，spriteと重なるgroup内のスプライトを返す
+        引数1 sprite：判定するスプライト
+        引数2 group：判定相手のグループ
+        引数3 dokill：Trueなら重なったスプライトをkillする
+        戻り値：重なったスプライトのリスト
+        """
+        rect = sprite.rect
+        hits = [other for other in self.query(rect, group) if rect.colliderect(other.rect)]
+        if dokill:
+            for other in hits:
+                other.kill()
+        return hits
+
+    def areacollide(self, bounds: pg.Rect, hit, group: pg.sprite.AbstractGroup, dokill: bool) -> list[pg.sprite.Sprite]:
+        """
+        Rect以外の形の範囲攻撃（レーザーの帯など）と重なるgroup内のスプライトを返す
+        boundsに重なるマスのうち，hitがTrueになるマスにいるスプライトだけを判定する
+        引数1 bounds：範囲全体を囲むRect
+        引数2 hit：Rectを受け取り，範囲と重なっていればTrueを返す関数
+        引数3 group：判定相手のグループ
+        引数4 dokill：Trueなら重なったスプライトをkillする
+        戻り値：重なったスプライトのリスト（グループへの追加順）
+        """
+        _, grid, order = self.grid_entry(group)
+        cs = self.cell_size
+        found: set[pg.sprite.Sprite] = set()
+        for cx, cy in self.cells(bounds):
+            sprites = grid.get((cx, cy))
+            if sprites and hit(pg.Rect(cx * cs, cy * cs, cs, cs)):
+                found.update(sprites)
+        hits = sorted((sprite for sprite in found if sprite in group and hit(sprite.rect)), key=order.__getitem__)
+        if dokill:
+            for sprite in hits:
+                sprite.kill()
+        return hits
+
+    def groupcollide(self, groupa: pg.sprite.AbstractGroup, groupb: pg.sprite.AbstractGroup, dokilla: bool, dokillb: bool) -> dict[pg.sprite.Sprite, list[pg.sprite.Sprite]]:
+        """
+        pg.sprite.groupcollideと同じく，2グループ間で重なったスプライトの辞書を返す
+        引数1 groupa：グループA
+        引数2 groupb：グループB
+        引数3 dokilla：Trueなら重なったAのスプライトをkillする
+        引数4 dokillb：Trueなら重なったBのスプライトをkillする
+        戻り値：Aのスプライトと，それに重なったBのスプライトのリストの辞書
+        """
+        crashed = {}
+        if not groupa or not groupb:
+            return crashed
+        candidates = groupa.sprites()
+        if len(groupb) < len(candidates):
+            # Bの方が少ないときは，Bのスプライトと同じマスにいるAだけをAのグループ内の順番で判定する
+            grida = self.grid(groupa)
+            near: set[pg.sprite.Sprite] = set()
+            for other in groupb.sprites():
+                for cell in self.cells(other.rect):
+                    near.update(grida.get(cell, ()))
+            candidates = [sprite for sprite in candidates if sprite in near]
+        for sprite in candidates:
+            hits = self.spritecollide(sprite, groupb, dokillb)
+            if hits:
+                crashed[sprite] = hits
+                if dokilla:
+                    sprite.kill()
+        return crashed
+
+
+class ObjectPool:
+    """
+    使い終わったものを捨てずに取っておき，次に必要になったときに再利用するプールの基底クラス
+    サブクラスは新しく作るmake()と，再利用する前に初期化するrenew()を実装する
+    """
+    def __init__(self):
+        self.free: list = []  # 再利用を待っているもの
+        self.hits = 0  # 再利用できた回数
+        self.misses = 0  # 新しく生成した回数
+        self.live = 0  # 貸し出し中の数
+        self.high_water = 0  # 貸し出し中の数の最大値
+
+    def make(self, *args):
+        """
+        空きが無いときに新しく作る
+        引数 args：acquireに渡された引数
+        """
+        raise NotImplementedError
+
+    def renew(self, item, *args):
+        """
+        空きから取り出したものを初期化する
+        引数1 item：取り出したもの
+        引数2以降 args：acquireに渡された引数
+        """
+        raise NotImplementedError
+
+    def acquire(self, *args):
+        """
+        1つ取り出す（空きがあれば初期化して再利用し，無ければ生成する）
+        引数 args：make/renewに渡す引数
+        戻り値：初期化済みのもの
+        """
+        if self.free:
+            item = self.free.pop()
+            self.renew(item, *args)
+            self.hits += 1
+        else:
+            item = self.make(*args)
+            self.misses += 1
+        self.live += 1
+        self.high_water = max(self.high_water, self.live)
+        return item
+
+    def release(self, item):
+        """
+        使い終わったものをプールに戻す
+        引数 item：戻すもの
+        """
+        self.live -= 1
+        self.free.append(item)
+
+    def stats(self) -> dict[str, int]:
+        """
+        プールの統計を返す
+        戻り値：再利用回数，生成回数，貸し出し中の数，その最大値，空きの数の辞書
+        """
+        return {"hits": self.hits, "misses": self.misses, "live": self.live,
+                "high_water": self.high_water, "free": len(self.free)}
+
+
+class SpritePool(ObjectPool):
+    """
+    killされたスプライトを捨てずに取っておき，次の生成時に状態を初期化して再利用するクラス
+    """
+    def __init__(self, cls: type):
+        """
+        引数 cls：プールするスプライトのクラス（Poolableのサブクラス）
+        """
+        super().__init__()
+        self.cls = cls
+
+    def make(self, *args) -> pg.sprite.Sprite:
+        sprite = self.cls(*args)
+        sprite.pool = self
+        return sprite
+
+    def renew(self, sprite: pg.sprite.Sprite, *args):
+        sprite.reset(*args)
+        sprite.generation += 1
+
+
+class Poolable(pg.sprite.Sprite):
+    """
+    SpritePoolで再利用できるスプライトの基底クラス
+    サブクラスは__init__と同じ引数で状態を初期化するreset()を実装する
+    """
+    pool: SpritePool | None = None  # プール経由で生成した時だけ設定される
+    generation = 0  # 再利用されるたびに1増える（MotionEngineが別物として扱うため）
+
+    def kill(self):
+        """
+        全グループから外し，プール経由で生成したものならプールに戻す
+        """
+        if self.pool is not None and self.alive():
+            self.pool.release(self)
+        super().kill()
+
+
+# ---- エンティティ・コンポーネント（ECS） ----
+# コンポーネントは__slots__だけを持つ小さなクラスで，__dict__を持たないぶん1個あたりのメモリが小さい
+# エンティティはint型の番号（消したものは再利用する）で，Worldがコンポーネントの型ごとに密な配列で保持する
+# 数値だけのコンポーネント（typecodesを持つ型）は，オブジェクトではなく属性ごとのarray（列）に値を入れて保持し，
+# システムは列をNumPyでまとめて演算する
+
+class Position:
+    """位置コンポーネント（中心座標）"""
+    __slots__ = ("x", "y")
+    typecodes = ("d", "d")  # 列で保持するときの各属性のarrayの型
+
+    def __init__(self, x: float, y: float):
+        self.x = x
+        self.y = y
+
+
+class Lifetime:
+    """寿命コンポーネント（残りの更新回数，負になったらエンティティを消す）"""
+    __slots__ = ("ticks",)
+    typecodes = ("i",)
+
+    def __init__(self, ticks: int):
+        self.ticks = ticks
+
+
+class Damage:
+    """
+    武器のコンポーネント：倒した相手の報酬にかける補正
+    weapon：武器の名前（武器ごとの撃破数の集計に使う），
+    exp_rate：経験値の倍率，blast：爆発時間の上書き（Noneなら倒した相手のScoreValueのまま）
+    """
+    __slots__ = ("weapon", "exp_rate", "blast")
+
+    def __init__(self, weapon: str, exp_rate: float = 1.0, blast: int | None = None):
+        self.weapon = weapon
+        self.exp_rate = exp_rate
+        self.blast = blast
+
+
+class ScoreValue:
+    """
+    倒される側のコンポーネント：倒した時の報酬
+    score：得点，exp：経験値，blast：爆発時間，cheer：こうかとんが喜ぶか
+    """
+    __slots__ = ("score", "exp", "blast", "cheer")
+
+    def __init__(self, score: int, exp: int, blast: int, cheer: bool = False):
+        self.score = score
+        self.exp = exp
+        self.blast = blast
+        self.cheer = cheer
+
+
+class Appearance:
+    """
+    見た目コンポーネント：残りの寿命に応じて切り替える画像のリストと，中心合わせのオフセット
+    状態を持たないので，同じ見た目のエンティティで1つを共有する
+    """
+    __slots__ = ("frames", "offset")
+
+    def __init__(self, frames: list[pg.Surface]):
+        self.frames = frames
+        self.offset = (-(frames[0].get_width() // 2), -(frames[0].get_height() // 2))
+
+
+class ComponentStore:
+    """
+    1つの型のコンポーネントを密な配列で保持するクラス（sparse set）
+    sparse[エンティティ]がdataの添字（持っていなければ-1）で，削除は末尾の要素と入れ替えて穴を作らない
+    """
+    __slots__ = ("entities", "data", "sparse", "version")
+
+    def __init__(self):
+        self.entities = array("i")  # i番目のコンポーネントを持つエンティティ
+        self.data: list = []  # コンポーネント本体
+        self.sparse = array("i")  # エンティティからdataの添字への対応
+        self.version = 0  # 追加・削除（列の値の書き換え）のたびに増やす（システムの中間結果のキャッシュの判定用）
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
+    def has(self, entity: int) -> bool:
+        return entity < len(self.sparse) and self.sparse[entity] >= 0
+
+    def index(self, entity: int) -> int:
+        """
+        エンティティを末尾に登録し，その添字を返す
+        引数 entity：エンティティの番号
+        """
+        if entity >= len(self.sparse):
+            self.sparse.extend([-1] * max(entity + 1 - len(self.sparse), len(self.sparse)))
+        i = self.sparse[entity] = len(self.entities)
+        self.entities.append(entity)
+        self.version += 1
+        return i
+
+    def add(self, entity: int, component):
+        self.index(entity)
+        self.data.append(component)
+
+    def get(self, entity: int):
+        return self.data[self.sparse[entity]]
+
+    def remove(self, entity: int):
+        i = self.sparse[entity]
+        self.sparse[entity] = -1
+        self.version += 1
+        last = self.entities.pop()
+        component = self.data.pop()
+        if i < len(self.entities):  # 末尾の要素を空いた位置に移す
+            self.entities[i] = last
+            self.data[i] = component
+            self.sparse[last] = i
+
+
+class ColumnStore(ComponentStore):
+    """
+    数値だけのコンポーネント（typecodesを持つ型）を，属性ごとのarray（列）で保持するsparse set
+    コンポーネントのオブジェクトは保持せず値だけを列に写すので，get()はその時点の値のコピーを返す
+    システムはnp.frombufferで列をコピーせずに配列として扱う（その配列が残っている間は列の長さを変えられない）
+    列の値を書き換えたシステムはversionを増やす
+    """
+    __slots__ = ("ctype", "columns")
+
+    def __init__(self, ctype: type):
+        """
+        引数 ctype：コンポーネントの型
+        """
+        super().__init__()
+        self.ctype = ctype
+        self.columns = {name: array(code) for name, code in zip(ctype.__slots__, ctype.typecodes)}  # 属性名と値の列
+
+    def add(self, entity: int, component):
+        self.index(entity)
+        for name, column in self.columns.items():
+            column.append(getattr(component, name))
+
+    def get(self, entity: int):
+        i = self.sparse[entity]
+        return self.ctype(*[column[i] for column in self.columns.values()])
+
+    def remove(self, entity: int):
+        i = self.sparse[entity]
+        self.sparse[entity] = -1
+        self.version += 1
+        last = self.entities.pop()
+        for column in self.columns.values():
+            value = column.pop()
+            if i < len(self.entities):
+                column[i] = value
+        if i < len(self.entities):  # 末尾の要素を空いた位置に移す
+            self.entities[i] = last
+            self.sparse[last] = i
+
+    def rows(self, entities):
+        """
+        エンティティの配列に対応する列の添字の配列を返す（持っていないエンティティは-1）
+        引数 entities：エンティティの番号のNumPy配列
+        戻り値：添字のNumPy配列
+        """
+        sparse = np.frombuffer(self.sparse, np.int32) if self.sparse else np.empty(0, np.int32)
+        rows = np.full(len(entities), -1, np.int32)
+        inside = entities < len(sparse)
+        rows[inside] = sparse[entities[inside]]
+        return rows
+
+
+class EntityPool(ObjectPool):
+    """
+    消したエンティティの番号を取っておき，次のエンティティに再利用して列を小さく保つプール
+    """
+    def __init__(self):
+        super().__init__()
+        self.next = 0  # まだ使っていない最小の番号
+
+    def make(self) -> int:
+        self.next += 1
+        return self.next - 1
+
+    def renew(self, entity: int):
+        pass
+
+
+class World:
+    """
+    エンティティとコンポーネントを管理するクラス
+    数値だけのコンポーネント（typecodesを持つ型）はColumnStoreの列に，それ以外はComponentStoreにオブジェクトのまま保持する
+    """
+    def __init__(self):
+        self.stores: dict[type, ComponentStore] = {}
+        self.entities = EntityPool()  # エンティティの番号のプール
+        self.cache: dict[type, tuple] = {}  # システムと，列から作った中間結果（作った時の列のversionとともに保持）
+
+    def store(self, ctype: type) -> ComponentStore:
+        """
+        型ごとのコンポーネントの配列を返す（システムはこれを直接走査する）
+        引数 ctype：コンポーネントの型
+        戻り値：ComponentStore（typecodesを持つ型ならColumnStore）
+        """
+        store = self.stores.get(ctype)
+        if store is None:
+            store = self.stores[ctype] = ColumnStore(ctype) if hasattr(ctype, "typecodes") else ComponentStore()
+        return store
+
+    def create(self, *components) -> int:
+        """
+        コンポーネントを持つエンティティを作る
+        引数 components：コンポーネント（型ごとに1つまで，列で保持する型は値だけを写す）
+        戻り値：エンティティの番号
+        """
+        entity = self.entities.acquire()
+        for component in components:
+            self.store(type(component)).add(entity, component)
+        return entity
+
+    def destroy(self, entity: int):
+        """
+        エンティティとそのコンポーネントをすべて消す
+        引数 entity：エンティティの番号
+        """
+        for store in self.stores.values():
+            if store.has(entity):
+                store.remove(entity)
+        self.entities.release(entity)
+
+    def get(self, entity: int, ctype: type):
+        """
+        エンティティのコンポーネントを返す
+        引数1 entity：エンティティの番号
+        引数2 ctype：コンポーネントの型
+        戻り値：コンポーネント（持っていなければNone，列で保持する型は値のコピー）
+        """
+        store = self.stores.get(ctype)
+        if store is None or not store.has(entity):
+            return None
+        return store.get(entity)
+
+    def query(self, *ctypes: type):
+        """
+        指定した型のコンポーネントをすべて持つエンティティを順に返す
+        引数 ctypes：コンポーネントの型
+        戻り値：(エンティティ, コンポーネント1, コンポーネント2, ...)のタプルを返すイテレータ
+        """
+        stores = [self.store(ctype) for ctype in ctypes]
+        first = min(stores, key=len)
+        for entity in list(first.entities):
+            if all(store.has(entity) for store in stores):
+                yield (entity, *[store.get(entity) for store in stores])
+
+    def count(self, ctype: type) -> int:
+        """
+        指定した型のコンポーネントを持つエンティティの数を返す
+        引数 ctype：コンポーネントの型
+        """
+        return len(self.store(ctype))
+
+
+class LifetimeSystem:
+    """寿命を1減らし，尽きたエンティティを消すシステム"""
+    @staticmethod
+    def run(world: World) -> list[int]:
+        """
+        引数 world：World
+        戻り値：消したエンティティのリスト
+        """
+        lifetimes = world.store(Lifetime)
+        if not lifetimes:
+            return []
+        if np is None:
+            ticks = lifetimes.columns["ticks"]
+            for i in range(len(ticks)):
+                ticks[i] -= 1
+            expired = [entity for entity, left in zip(lifetimes.entities, ticks) if left < 0]
+        else:
+            ticks = np.frombuffer(lifetimes.columns["ticks"], np.int32)
+            ticks -= 1
+            expired = np.frombuffer(lifetimes.entities, np.int32)[ticks < 0].tolist()
+            del ticks  # 列の配列を手放してから消す（消すと列が短くなる）
+        for entity in expired:
+            world.destroy(entity)
+        return expired
+
+
+class AppearanceSystem:
+    """見た目を持つエンティティを描画するシステム"""
+    @staticmethod
+    def draw(world: World, screen: pg.Surface, animate: bool = True) -> list[pg.Rect]:
+        """
+        引数1 world：World
+        引数2 screen：画面Surface
+        引数3 animate：Trueなら残りの寿命に応じて画像を切り替え，Falseなら最初の画像のまま
+        戻り値：描画した範囲のRectのリスト
+        """
+        return screen.blits(AppearanceSystem.sequence(world, animate))
+
+    @staticmethod
+    def sequence(world: World, animate: bool = True) -> list[tuple[pg.Surface, tuple[float, float]]]:
+        """
+        見た目を持つエンティティの(画像, 左上の座標)のリストを作る（screen.blitsにそのまま渡せる）
+        位置と寿命は添字の対応（sparse）から列を直接引き，NumPyがあれば同じ見た目ごとにまとめて計算する
+        左上の座標は見た目・位置の列が変わらない間はworld.cacheのものを使い，毎回は画像だけを選び直す
+        引数1 world：World
+        引数2 animate：Trueなら残りの寿命に応じて画像を切り替え，Falseなら最初の画像のまま
+        戻り値：(画像, 左上の座標)のリスト
+        """
+        appearances, positions, lifetimes = world.store(Appearance), world.store(Position), world.store(Lifetime)
+        if not appearances:
+            return []
+        xs, ys, ticks = positions.columns["x"], positions.columns["y"], lifetimes.columns["ticks"]
+        seq = []
+        if np is None:
+            pos_sparse, life_sparse, life_len = positions.sparse, lifetimes.sparse, len(lifetimes.sparse)
+            for entity, app in zip(appearances.entities, appearances.data):
+                i = pos_sparse[entity]
+                frames = app.frames
+                if animate and entity < life_len and life_sparse[entity] >= 0:
+                    frame = frames[ticks[life_sparse[entity]] // 10 % len(frames)]
+                else:
+                    frame = frames[0]
+                seq.append((frame, (xs[i] + app.offset[0], ys[i] + app.offset[1])))
+            return seq
+        entities = np.frombuffer(appearances.entities, np.int32)
+        key = (appearances.version, positions.version)
+        cached = world.cache.get(AppearanceSystem)
+        if cached is None or cached[0] != key:
+            pos_rows = positions.rows(entities)
+            xs = np.frombuffer(xs, np.float64)[pos_rows]
+            ys = np.frombuffer(ys, np.float64)[pos_rows]
+            shared = dict.fromkeys(appearances.data)  # 見た目は共有されるので，同じ見た目ごとにまとめて計算する
+            ids = np.fromiter(map(id, appearances.data), np.int64, len(entities)) if len(shared) > 1 else None
+            groups = []  # (見た目, そのエンティティの添字, 左上の座標のリスト)
+            for app in shared:
+                mask = slice(None) if ids is None else np.flatnonzero(ids == id(app))
+                groups.append((app, mask, list(zip((xs[mask] + app.offset[0]).tolist(), (ys[mask] + app.offset[1]).tolist()))))
+            cached = world.cache[AppearanceSystem] = (key, groups)
+        life_rows = lifetimes.rows(entities)
+        ticks = np.frombuffer(ticks, np.int32)[life_rows] if ticks else np.zeros(len(entities), np.int32)
+        for app, mask, dests in cached[1]:
+            frames = app.frames
+            if animate and len(frames) > 1:
+                index = np.where(life_rows[mask] >= 0, ticks[mask] // 10 % len(frames), 0)
+                seq.extend(zip(map(frames.__getitem__, index.tolist()), dests))
+            else:
+                seq.extend(zip([frames[0]] * len(dests), dests))
+        return seq
+
+
+class KillRewardSystem:
+    """
+    倒した敵機・爆弾の報酬（得点，経験値，爆発，こうかとんの表情）をまとめて与えるシステム
+    報酬は倒された側のScoreValueと，倒した武器のDamageで決まる
+    """
+    def __init__(self, score: "Score", bird: "Bird", explode):
+        """
+        引数1 score：スコア
+        引数2 bird：経験値を受け取るこうかとん
+        引数3 explode：(倒したスプライト, 爆発時間)を受け取り爆発を出す関数
+        """
+        self.score = score
+        self.bird = bird
+        self.explode = explode
+        self.kills: dict[str, int] = {}  # 武器の名前と倒した数の辞書
+
+    def run(self, kills: list[tuple[pg.sprite.Sprite, Damage]]):
+        """
+        引数 kills：(倒したスプライト, 倒した武器のDamage)のリスト
+        """
+        for victim, damage in kills:
+            self.kills[damage.weapon] = self.kills.get(damage.weapon, 0) + 1
+            value = victim.score_value
+            self.explode(victim, value.blast if damage.blast is None else damage.blast)
+            self.score.value += value.score
+            if value.cheer:
+                self.bird.change_img(6)  # こうかとん喜びエフェクト
+            if damage.exp_rate:
+                self.bird.gain_experience(int(value.exp * damage.exp_rate))
+
+
 class Bird(pg.sprite.Sprite):
     """
     ゲームキャラクター（こうかとん）に関するクラス
@@ -49,6 +1022,8 @@ class Bird(pg.sprite.Sprite):
         pg.K_LEFT: (-1, 0),
         pg.K_RIGHT: (+1, 0),
     }
+    # 各レベルから次のレベルに上がるのに必要な経験値（表より上のレベルでは最後の値を使う）
+    exp_thresholds = [50, 100, 100]
 
     def __init__(self, num: int, xy: tuple[int, int]):
         """
@@ -57,48 +1032,27 @@ class Bird(pg.sprite.Sprite):
         引数2 xy：こうかとん画像の位置座標タプル
         """
         super().__init__()
-        img0 = pg.transform.rotozoom(pg.image.load(f"fig/{num}.png"), 0, 1.0)
-        img = pg.transform.flip(img0, True, False)  # デフォルトのこうかとん
-        self.imgs = {
-            (+1, 0): img,  # 右
-            (+1, -1): pg.transform.rotozoom(img, 45, 1.0),  # 右上
-            (0, -1): pg.transform.rotozoom(img, 90, 1.0),  # 上
-            (-1, -1): pg.transform.rotozoom(img0, -45, 1.0),  # 左上
-            (-1, 0): img0,  # 左
-            (-1, +1): pg.transform.rotozoom(img0, 45, 1.0),  # 左下
-            (0, +1): pg.transform.rotozoom(img, -90, 1.0),  # 下
-            (+1, +1): pg.transform.rotozoom(img, -45, 1.0),  # 右下
-        }
+        self.rotations = Assets.rotations(f"{num}", flip_x=True)  # 任意方向の回転画像キャッシュ（必要な角度だけ生成）
+        self.draw_step: float | None = None  # 描画する回転画像の角度の刻み幅（Noneなら回転キャッシュの既定値）
         self.dire = (+1, 0)
-        self.image = self.imgs[self.dire]
+        self.image = Assets.flipped(f"{num}", True, False)  # デフォルトのこうかとん（右向き）
+        self.flash: pg.Surface | None = None  # このフレームだけ重ねて表示する表情画像
         self.rect = self.image.get_rect()
         self.rect.center = xy
         self.speed = 6
 
-        # レベルと経験値の初期化
+        # レベルと経験値の初期化（表示はHudクラスが行う）
         self.level = 1
         self.experience = 0
-        self.exp_to_next_level = 50
-        self.font = pg.font.Font(None, 50)
-
-    def change_img(self, num: int, screen: pg.Surface):
-        """
-        こうかとん画像を切り替え，画面に転送する
-        引数1 num：こうかとん画像ファイル名の番号
-        引数2 screen：画面Surface
-        """
-        self.image = pg.transform.rotozoom(pg.image.load(f"fig/{num}.png"), 0, 1.0)
-        screen.blit(self.image, self.rect)
+        self.exp_to_next_level = self.exp_thresholds[0]
 
-    # マウスの方向にスピード5で進むようにする
-    def update(self, mouse_pos: tuple[int, int], screen: pg.Surface):
+    def change_img(self, num: int):
         """
-        マウスの方向に応じてこうかとんを移動させる
-        引数1 mouse_pos：マウスの現在位置座標タプル
-        引数2 screen：画面Surface
+        こうかとん画像を切り替え，このフレームの描画で表情として重ねて表示する
+        引数 num：こうかとん画像ファイル名の番号
         """
-        x_diff, y_diff = mouse_pos[0] - self.rect.centerx, mouse_pos[1] - self.rect.centery
-        norm = math.sqrt(x_diff**2 + y_diff**2)
+        self.image = Assets.get(f"{num}")
+        self.flash = self.image
 
     def gain_experience(self, amount: int):
         """
@@ -115,39 +1069,14 @@ class Bird(pg.sprite.Sprite):
         """
         self.level += 1
         self.experience = 0  # 経験値をリセット
-        if self.level == 2:
-            self.exp_to_next_level = 100  # レベル3になるための経験値を100に設定
-        elif self.level == 3:
-            self.exp_to_next_level = 100  # 次のレベルまでの経験値を150に設定
+        self.exp_to_next_level = self.exp_thresholds[min(self.level, len(self.exp_thresholds)) - 1]
         self.speed += 1  # レベルアップ時に速度を上げるなどの強化
 
-    def display_level(self, screen: pg.Surface):
-        """
-        レベルを画面に表示する
-        引数 screen: 画面Surface
-        """
-        level_surf = self.font.render(f"Level: {self.level}", True, (0, 255, 0))
-        screen.blit(level_surf, (50, 50))
-
-    def display_experience_bar(self, screen: pg.Surface):
-        """
-        経験値ゲージを画面に表示する
-        引数 screen: 画面Surface
-        """
-        bar_width = 400
-        bar_height = 20
-        filled_bar_width = int(bar_width * self.experience / self.exp_to_next_level)
-        
-        # 背景のバー
-        pg.draw.rect(screen, (128, 128, 128), (50, 100, bar_width, bar_height)) # グレー
-        # 埋まっている部分
-        pg.draw.rect(screen, (0, 255, 0), (50, 100, filled_bar_width, bar_height)) # 緑
-
-    def update(self, mouse_pos: tuple[int, int], screen: pg.Surface):
+    # マウスの方向にスピード5で進むようにする
+    def update(self, mouse_pos: tuple[int, int]):
         """
         マウスの方向に応じてこうかとんを移動させる
-        引数1 mouse_pos：マウスの現在位置座標タプル
-        引数2 screen：画面Surface
+        引数 mouse_pos：マウスの現在位置座標タプル
         """
         x_diff, y_diff = mouse_pos[0] - self.rect.centerx, mouse_pos[1] - self.rect.centery
         norm = math.sqrt(x_diff**2 + y_diff**2)
@@ -163,15 +1092,23 @@ class Bird(pg.sprite.Sprite):
         if x_diff != 0 or y_diff != 0:
             self.dire = (x_diff / norm, y_diff / norm)
             angle = math.degrees(math.atan2(-self.dire[1], self.dire[0]))
-            self.image = pg.transform.rotozoom(self.imgs[(+1, 0)], angle, 1.0)
-        
-        screen.blit(self.image, self.rect)
-        self.display_level(screen)
-        self.display_experience_bar(screen)
-
+            self.image = self.rotations.get(angle, self.draw_step)[0]
 
+    def draw(self, screen: pg.Surface, offset: tuple[int, int] = (0, 0)) -> list[pg.Rect]:
+        """
+        こうかとん（と表情）を画面に描画する
+        引数1 screen：画面Surface
+        引数2 offset：補間のために描画位置をずらす量
+        戻り値：描画した範囲のRectのリスト
+        """
+        rect = self.rect.move(offset)
+        rects = []
+        if self.flash is not None:
+            rects.append(screen.blit(self.flash, rect))
+            self.flash = None
+        rects.append(screen.blit(self.image, self.image.get_rect(center=rect.center)))
+        return rects
 
-    
     def shoot_laser(self):
         """
         レーザーを発射するメソッド
@@ -179,11 +1116,13 @@ class Bird(pg.sprite.Sprite):
         return Laser(self)
 
 
-class Bomb(pg.sprite.Sprite):
+class Bomb(Poolable):
     """
     爆弾に関するクラス
     """
+    score_value = ScoreValue(score=1, exp=5, blast=50)  # 倒した時の報酬
     colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255), (0, 255, 255)]
+    imgs: dict[tuple[int, tuple[int, int, int]], pg.Surface] = {}  # (半径, 色)ごとの描画済み爆弾円
 
     def __init__(self, emy: "Enemy", bird: Bird):
         """
@@ -192,11 +1131,33 @@ class Bomb(pg.sprite.Sprite):
         引数2 bird：攻撃対象のこうかとん
         """
         super().__init__()
+        self.reset(emy, bird)
+
+    @classmethod
+    def circle(cls, rad: int, color: tuple[int, int, int]) -> pg.Surface:
+        """
+        半径と色の組み合わせごとに一度だけ爆弾円を描画し，以降は使い回す
+        引数1 rad：爆弾円の半径
+        引数2 color：爆弾円の色
+        戻り値：爆弾円Surface
+        """
+        key = (rad, color)
+        if key not in cls.imgs:
+            img = pg.Surface((2*rad, 2*rad))
+            pg.draw.circle(img, color, (rad, rad), rad)
+            img.set_colorkey((0, 0, 0))
+            cls.imgs[key] = img
+        return cls.imgs[key]
+
+    def reset(self, emy: "Enemy", bird: Bird):
+        """
+        爆弾の状態を初期化する（プールからの再利用時にも呼ばれる）
+        引数1 emy：爆弾を投下する敵機
+        引数2 bird：攻撃対象のこうかとん
+        """
         rad = random.randint(10, 50)  # 爆弾円の半径：10以上50以下の乱数
-        self.image = pg.Surface((2*rad, 2*rad))
         color = random.choice(__class__.colors)  # 爆弾円の色：クラス変数からランダム選択
-        pg.draw.circle(self.image, color, (rad, rad), rad)
-        self.image.set_colorkey((0, 0, 0))
+        self.image = __class__.circle(rad, color)
         self.rect = self.image.get_rect()
         # 爆弾を投下するemyから見た攻撃対象のbirdの方向を計算
         self.vx, self.vy = calc_orientation(emy.rect, bird.rect)  
@@ -214,135 +1175,268 @@ class Bomb(pg.sprite.Sprite):
             self.kill()
 
 
-class Beam(pg.sprite.Sprite):
-    def __init__(self, bird: Bird, target: pg.Rect):
+class Beam(Poolable):
+    """
+    ビームに関するクラス
+    移動と画面外での削除はNeoBeamがすべてのビームをまとめて行う
+    """
+    damage = Damage("beam")  # 倒した相手の報酬の補正
+
+    def __init__(self, bird: Bird, target: pg.Rect, offset: float = 0.0):
         """
         ビーム画像Surfaceを生成する
-        引数 bird：ビームを放つこうかとん
-        引数 target：ビームの目標となる敵
+        引数1 bird：ビームを放つこうかとん
+        引数2 target：ビームの目標となる敵
+        引数3 offset：目標の方向からずらす角度[度]（反時計回り）
         """
         super().__init__()
+        self.reset(bird, target, offset)
+
+    def reset(self, bird: Bird, target: pg.Rect, offset: float = 0.0):
+        """
+        ビームの状態を初期化する（プールからの再利用時にも呼ばれる）
+        引数1 bird：ビームを放つこうかとん
+        引数2 target：ビームの目標となる敵
+        引数3 offset：目標の方向からずらす角度[度]（反時計回り）
+        """
         # こうかとん(bird)から敵(target)への方向ベクトルを計算
         self.vx, self.vy = calc_orientation(bird.rect, target)
         # ビームの角度を計算
         angle = math.degrees(math.atan2(-self.vy, self.vx))
-        # ビーム画像を方向に合わせて回転
-        self.image = pg.transform.rotozoom(pg.image.load(f"fig/beam.png"), angle, 2.0)
+        if offset:
+            angle += offset
+            self.vx, self.vy = math.cos(math.radians(angle)), -math.sin(math.radians(angle))
+        # ビーム画像を方向に合わせて回転（当たり判定のrectは描画品質によらず既定の刻み幅の画像から作る）
+        self.angle = angle
+        self.image = Assets.rotations("beam", 2.0).get(angle)[0]
         self.rect = self.image.get_rect()
         # ビームの初期位置を設定
         self.rect.centery = bird.rect.centery + bird.rect.height * self.vy
         self.rect.centerx = bird.rect.centerx + bird.rect.width * self.vx
-        self.speed = 10    
+        self.speed = 10
 
 
-    def update(self):
-        """
-        爆弾を速度ベクトルself.vx, self.vyに基づき移動させる
-        引数 screen：画面Surface
-        """
-        self.rect.move_ip(self.speed*self.vx, self.speed*self.vy)
-        if check_bound(self.rect) != (True, True):
-            self.kill()
+class Laser(pg.sprite.Sprite):
+    """
+    こうかとんの位置から向いている方向の画面端まで，一直線に出るレーザークラス
+    当たり判定は太さのある線分とRectの計算で行い，画面全体の大きさのSurfaceやRectは使わない
+    描画は根元の画像と胴体のタイル画像を線分に沿って並べる（回転画像は全レーザーで共有）
+    """
+    width = 60  # レーザーの太さ[px]
+    damage = Damage("laser", exp_rate=0.0)  # レーザーで倒しても経験値は入らない
+    scale = 60 / 175  # biglaser.pngの光の帯（高さ約175px）を太さに合わせる拡大率
+    body: RotationCache | None = None  # 胴体のタイル画像の回転キャッシュ
 
-    def update(self):
+    @classmethod
+    def body_rotations(cls) -> RotationCache:
         """
-        ビームを速度ベクトルself.vx, self.vyに基づき移動させる
-        引数 screen：画面Surface
+        胴体のタイル画像の回転キャッシュを返す（初めて使うときに作る）
+        戻り値：胴体のRotationCache
         """
-        self.rect.move_ip(self.speed*self.vx, self.speed*self.vy)
-        if check_bound(self.rect) != (True, True):
-            self.kill()
+        if cls.body is None:
+            src = Assets.get("biglaser")
+            cls.body = RotationCache(src.subsurface((300, 0, 120, src.get_height())), scale=cls.scale)
+        return cls.body
 
-class Laser(pg.sprite.Sprite):
-    """
-    一直線に出るレーザークラス
-    """
     def __init__(self, bird: Bird, duration: int = 3000):  # デフォルトの持続時間を3000ミリ秒に設定
         super().__init__()
-        self.vx, self.vy = bird.dire
-        angle = math.degrees(math.atan2(-self.vy, self.vx))
-        self.image = pg.transform.rotozoom(pg.image.load(f"fig/biglaser.png"), angle, 1.0)
-        self.rect = self.image.get_rect()
+        # 描画する回転画像と向きを揃えるため，角度は回転キャッシュの刻み幅に丸める
+        self.angle = round(math.degrees(math.atan2(-bird.dire[1], bird.dire[0])) / ROTATION_STEP) * ROTATION_STEP
+        self.vx, self.vy = math.cos(math.radians(self.angle)), -math.sin(math.radians(self.angle))
+        self.head = Assets.rotations("biglaser", self.scale)
+
+        # 発射位置（こうかとんの位置）から画面端までの線分
+        x, y = bird.rect.center
+        far = math.hypot(WIDTH, HEIGHT)
+        clipped = pg.Rect(0, 0, WIDTH, HEIGHT).clipline((x, y), (x + self.vx*far, y + self.vy*far))
+        self.start, self.end = clipped if clipped else ((x, y), (x, y))
+        self.length = math.dist(self.start, self.end)
+        # 線分を囲むRect（広域探索の範囲として使う）
+        half = self.width // 2
+        self.rect = pg.Rect(min(self.start[0], self.end[0]) - half, min(self.start[1], self.end[1]) - half,
+                            abs(self.end[0] - self.start[0]) + self.width, abs(self.end[1] - self.start[1]) + self.width)
 
-        # レーザーを画面全体に伸ばす
-        self.image = pg.transform.scale(self.image, (WIDTH,HEIGHT))
-
-        # 発射位置をこうかとんの頭の位置に設定
-        self.rect_WIDTH = self.image.get_width()
-        self.rect.centerx = self.rect.centerx + self.rect_WIDTH/2
-        self.rect.centery = self.rect.centery
-
-        
         self.speed = 0  # 動かないから速度は0
         self.duration = duration  # ミリ秒
-        self.spawn_time = pg.time.get_ticks()  # 発生時刻
-    
+        self.life = duration * FPS // 1000  # 持続時間をフレーム数に換算（実時間に依存させない）
+
+    def hit(self, rct: pg.Rect) -> bool:
+        """
+        レーザーの帯がRectと重なっているかを判定する
+        引数 rct：判定するRect
+        戻り値：重なっていればTrue
+        """
+        return segment_rect_collide(self.start, self.end, self.width / 2, rct)
+
+    def draw(self, screen: pg.Surface) -> list[pg.Rect]:
+        """
+        根元の画像から画面端まで胴体のタイルを並べて描画する
+        引数 screen：画面Surface
+        戻り値：描画した範囲のRectのリスト
+        """
+        head, (dx, dy) = self.head.get(self.angle)
+        head_len = Assets.get("biglaser").get_width() * self.scale
+        x, y = self.start
+        seq = [(head, (x + self.vx*head_len/2 + dx, y + self.vy*head_len/2 + dy))]
+        tile, (dx, dy) = self.body_rotations().get(self.angle)
+        step = 120 * self.scale - 2  # 継ぎ目が見えないように少し重ねる
+        dist = head_len
+        while dist < self.length + step:
+            seq.append((tile, (x + self.vx*dist + dx, y + self.vy*dist + dy)))
+            dist += step
+        rects = screen.blits(seq)
+        return [rects[0].unionall(rects[1:])]
+
     def update(self):
         """
-        レーザーを速度ベクトルself.vx, self.vyに基づき移動させる
+        持続時間を1フレーム分減らし，指定時間が経過したらレーザーを消す
         """
-        current_time = pg.time.get_ticks()
-        if current_time - self.spawn_time > self.duration:  # 指定時間が経過したら
+        self.life -= 1
+        if self.life < 0:  # 指定時間が経過したら
             self.kill()  # レーザーを消す
 
-class NeoBeam(pg.sprite.Sprite):
+class NeoBeam:
     """
-    一度に複数方向へビームを発射するクラス
+    一度に複数方向へビームを発射し，発射したビームをまとめて動かす武器クラス
+    ビームの位置と速度は並列のリスト（バッチ）に持ち，update()の1回のループで全ビームを進める
+    ビーム画像は全ビームで共有の回転キャッシュ（Assets.rotations("beam", 2.0)）から取る
     """
-    def __init__(self, bird: Bird, num: int):
+    def __init__(self, bird: Bird, group: pg.sprite.AbstractGroup, grid: SpatialHash, pool: SpritePool,
+                 num: int = 5, spread: float = 100):
+        """
+        引数1 bird：ビームを放つこうかとん
+        引数2 group：ビームのグループ（衝突判定と描画に使う）
+        引数3 grid：ビームを登録する空間ハッシュ
+        引数4 pool：Beamのプール
+        引数5 num：1回に発射するビームの数
+        引数6 spread：ビームを広げる角度の幅[度]
+        """
         self.bird = bird
+        self.group = group
+        self.grid = grid
+        self.pool = pool
         self.num = num
+        self.spread = spread
+        # バッチ：i番目の要素がi番目のビームの状態を表す
+        self.sprites: list[Beam] = []
+        self.generations: list[int] = []  # 登録時の世代（プールで再利用されたものを見分ける）
+        self.xs: list[float] = []
+        self.ys: list[float] = []
+        self.vxs: list[float] = []  # 1フレームあたりの移動量
+        self.vys: list[float] = []
+
+    def offsets(self, num: int) -> list[float]:
+        """
+        ビームごとに目標の方向からずらす角度を返す
+        引数 num：ビームの数
+        戻り値：角度[度]のリスト（幅spreadに等間隔）
+        """
+        if num == 1:
+            return [0.0]
+        step = self.spread / (num - 1)  # ステップの計算
+        return [-self.spread/2 + step * i for i in range(num)]
 
-    def gen_beams(self):
+    def fire(self, target: pg.Rect, num: int | None = None) -> list[Beam]:
         """
-        指定された数のビームを生成し、リストで返す
+        目標の方向を中心に扇形にビームを発射する
+        引数1 target：ビームの目標となる敵のRect
+        引数2 num：発射するビームの数（Noneならself.num）
+        戻り値：発射したビームのリスト
         """
-        beams = []
-        step = 100 / (self.num - 1) #ステップの計算
-        angles = [-50 + step * i for i in range(self.num)] #角度をリストに入れる
-        for angle in angles:
-            beams.append(Beam(self.bird, angle)) #リストにappend
-        return beams #リストを戻り値に設定
-    
+        beams = [self.pool.acquire(self.bird, target, offset) for offset in self.offsets(self.num if num is None else num)]
+        self.grid.add(self.group, *beams)
+        for beam in beams:
+            self.sprites.append(beam)
+            self.generations.append(beam.generation)
+            self.xs.append(float(beam.rect.centerx))
+            self.ys.append(float(beam.rect.centery))
+            self.vxs.append(beam.speed * beam.vx)
+            self.vys.append(beam.speed * beam.vy)
+        return beams
 
-class Explosion(pg.sprite.Sprite):
+    def update(self):
+        """
+        バッチ内の全ビームを1フレーム分進め，画面外に出たものをkillする
+        衝突でkillされたビーム（再利用されたものを含む）はバッチから外す
+        """
+        sprites, generations, xs, ys, vxs, vys = [], [], [], [], [], []
+        for sprite, gen, x, y, vx, vy in zip(self.sprites, self.generations, self.xs, self.ys, self.vxs, self.vys):
+            if gen != sprite.generation or not sprite.alive():
+                continue
+            x += vx
+            y += vy
+            rect = sprite.rect
+            rect.center = round(x), round(y)
+            if rect.left < 0 or WIDTH < rect.right or rect.top < 0 or HEIGHT < rect.bottom:  # check_boundと同じ条件
+                sprite.kill()
+                continue
+            sprites.append(sprite)
+            generations.append(gen)
+            xs.append(x)
+            ys.append(y)
+            vxs.append(vx)
+            vys.append(vy)
+        self.sprites, self.generations, self.xs, self.ys, self.vxs, self.vys = sprites, generations, xs, ys, vxs, vys
+
+
+class Explosion:
     """
     爆発に関するクラス
+    爆発はスプライトではなくECSのエンティティ（Position，Lifetime，Appearance）で，
+    LifetimeSystemが寿命を減らし，AppearanceSystemが残りの寿命に応じて画像を切り替えて描画する
+    PositionとLifetimeは値だけがWorldの列に入り，エンティティの番号と列の行は消した爆発のものを再利用する
     """
-    
-    def __init__(self, obj: "Bomb|Enemy", life: int):
-        """
-        爆弾が爆発するエフェクトを生成する
-        引数1 obj：爆発するBombまたは敵機インスタンス
-        引数2 life：爆発時間
-        """
-        super().__init__()
-        img = pg.image.load(f"fig/explosion.gif")
-        self.imgs = [img, pg.transform.flip(img, 1, 1)]
-        self.image = self.imgs[0]
-        self.rect = self.image.get_rect(center=obj.rect.center)
-        self.life = life
+    appearance: Appearance | None = None  # 全爆発で共有する見た目
 
-    def update(self):
+    @classmethod
+    def create(cls, world: World, obj: "Bomb|Enemy", life: int) -> int:
         """
-        爆発時間を1減算した爆発経過時間_lifeに応じて爆発画像を切り替えることで
-        爆発エフェクトを表現する
+        爆弾が爆発するエフェクトを生成する
+        引数1 world：World
+        引数2 obj：爆発するBombまたは敵機インスタンス
+        引数3 life：爆発時間
+        戻り値：エンティティの番号
         """
-        self.life -= 1
-        self.image = self.imgs[self.life//10%2]
-        if self.life < 0:
-            self.kill()
+        if cls.appearance is None:
+            cls.appearance = Appearance([Assets.get("explosion"), Assets.flipped("explosion", True, True)])
+        x, y = obj.rect.center
+        return world.create(Position(x, y), Lifetime(life), cls.appearance)
 
 
-class Enemy(pg.sprite.Sprite):
+class Enemy(Poolable):
     """
     敵機に関するクラス
+    移動と向きの切り替えはFlowField（MotionEngineを使うときはMotionEngine）がまとめて行う
     """
-    imgs = [pg.image.load(f"fig/enemy{i}.png") for i in range(1, 4)]
-    
-    def __init__(self, bird: Bird):
+    score_value = ScoreValue(score=10, exp=10, blast=100, cheer=True)  # 倒した時の報酬
+    img_names = [f"enemy{i}" for i in range(1, 4)]
+
+    def __init__(self, bird: Bird, name: str | None = None, speed: int = 4):
+        """
+        引数1 bird：追いかける対象のこうかとん
+        引数2 name：敵機の画像名（Noneならimg_namesからランダムに選ぶ）
+        引数3 speed：敵機の速さ
+        """
         super().__init__()
-        self.original_image = random.choice(__class__.imgs)
+        self.reset(bird, name, speed)
+
+    def reset(self, bird: Bird, name: str | None = None, speed: int = 4):
+        """
+        敵機の状態を初期化し，画面の端に配置する（プールからの再利用時にも呼ばれる）
+        引数1 bird：追いかける対象のこうかとん
+        引数2 name：敵機の画像名（Noneならimg_namesからランダムに選ぶ）
+        引数3 speed：敵機の速さ
+        """
+        if name is None:
+            name = random.choice(__class__.img_names)
+        self.original_image = Assets.get(name)
+        # 向きごとの画像は共有キャッシュから取得し，毎フレームの変形を避ける
+        self.facing_imgs = {
+            "left": self.original_image,
+            "right": Assets.flipped(name, True, False),
+            "up": Assets.rotated(name, -90),
+            "down": Assets.rotated(name, 90),
+        }
         self.image = self.original_image
         self.rect = self.image.get_rect()
         self.bird = bird
@@ -357,32 +1451,243 @@ class Enemy(pg.sprite.Sprite):
         elif direction == 'bottom':
             self.rect.center = random.randint(0, WIDTH), HEIGHT
         
-        self.speed = 4
+        self.speed = speed
 
-    def update(self):
+
+class FlowField:
+    """
+    画面をマスに分け，マスごとにこうかとんへ向かう単位ベクトル（フローフィールド）を持つクラス
+    フィールドは数回/秒だけ作り直し，敵機は自分のマスのベクトルを引くだけで進む方向が決まる
+    任意で，周りのマスの混み具合から押し出す分離（separation）を加え，敵機が1点に重ならないようにする
+    """
+    def __init__(self, cell_size: int = 32, interval: int = 10, separation: float = 0.0):
+        """
+        引数1 cell_size：マスの一辺の長さ[px]
+        引数2 interval：フィールドを作り直す間隔[更新回数]
+        引数3 separation：分離の強さ（0なら分離しない）
+        """
+        self.cell_size = cell_size
+        self.interval = interval
+        self.separation = separation
+        self.cols = WIDTH // cell_size + 1
+        self.rows = HEIGHT // cell_size + 1
+        n = self.cols * self.rows
+        self.distance = [0.0] * n  # マスの中心からこうかとんまでの距離
+        self.dirs: list[tuple[float, float]] = [(0.0, 0.0)] * n  # マスごとの進む方向の単位ベクトル
+        self.facings: list[str] = ["left"] * n  # マスごとの敵機の向き（Enemy.facing_imgsのキー）
+        self.built_at: int | None = None  # 最後にフィールドを作った更新回数
+        self.rebuilds = 0
+        # 座標からマスの番号を引く表（画面の外margin[px]までは表で，それより外は端のマスに丸めて計算する）
+        self.margin = margin = WIDTH
+        self.col_of = [min(max((x - margin) // cell_size, 0), self.cols - 1) for x in range(WIDTH + 2*margin)]
+        self.row_of = [min(max((y - margin) // cell_size, 0), self.rows - 1) * self.cols for y in range(HEIGHT + 2*margin)]
+        self.steps: dict[int, list[tuple[float, float]]] = {}  # 速さごとの，マスの1回分の移動量（作り直すたびに空にする）
+
+    def rebuild(self, target: tuple[int, int]):
+        """
+        目標に向かうフィールドを作り直す
+        障害物がないので，距離はマスの中心から目標までの直線距離，方向はその勾配（目標への単位ベクトル）になる
+        引数 target：目標の座標（こうかとんの中心）
+        """
+        cs, cols = self.cell_size, self.cols
+        tx, ty = target
+        for row in range(self.rows):
+            dy = ty - (row + 0.5) * cs
+            for col in range(cols):
+                dx = tx - (col + 0.5) * cs
+                d = math.hypot(dx, dy)
+                i = row * cols + col
+                self.distance[i] = d
+                self.dirs[i] = (dx / d, dy / d) if d > 0 else (0.0, 0.0)
+                # 横方向の移動が大きければ左右，縦方向が大きければ上下を向く（MotionEngineと同じ規則）
+                if abs(dx) > abs(dy):
+                    self.facings[i] = "right" if dx > 0 else "left"
+                else:
+                    self.facings[i] = "up" if dy < 0 else "down"
+        self.steps.clear()
+        self.rebuilds += 1
+
+    def update(self, target: tuple[int, int], tmr: int):
         """
-        敵機をこうかとんの位置に向かって移動させる
+        前回作ってからinterval回以上更新していれば，フィールドを作り直す
+        引数1 target：目標の座標
+        引数2 tmr：開始からの更新回数
         """
-        bird_x, bird_y = self.bird.rect.center  # こうかとんの位置を取得
-        x_diff, y_diff = bird_x - self.rect.centerx, bird_y - self.rect.centery
-        angle = math.degrees(math.atan2(-y_diff, x_diff))  # 角度を計算
+        if self.built_at is None or tmr - self.built_at >= self.interval:
+            self.rebuild(target)
+            self.built_at = tmr
 
-        if abs(x_diff) > abs(y_diff):  # 横方向の移動が大きい場合
-            if x_diff > 0:  # こうかとんが右にいる場合
-                self.image = pg.transform.flip(self.original_image, True, False)
-            else:  # こうかとんが左にいる場合
-                self.image = self.original_image
-            self.image = pg.transform.rotate(self.image, 0)
-        else:  # 縦方向の移動が大きい場合
-            if y_diff < 0:  # こうかとんが下にいる場合
-                self.image = pg.transform.rotate(self.original_image, -90)
-            else:  # こうかとんが上にいる場合
-                self.image = pg.transform.rotate(self.original_image, 90)
+    def cell(self, x: int, y: int) -> int:
+        """
+        座標のあるマスの番号を返す（画面の外の座標は端のマスに丸める）
+        引数1 x：x座標
+        引数2 y：y座標
+        戻り値：マスの番号（row * cols + col）
+        """
+        m = self.margin
+        if -m <= x < WIDTH + m and -m <= y < HEIGHT + m:
+            return self.col_of[x + m] + self.row_of[y + m]
+        return min(max(y // self.cell_size, 0), self.rows - 1) * self.cols + min(max(x // self.cell_size, 0), self.cols - 1)
 
-        norm = math.sqrt(x_diff**2 + y_diff**2)
-        if norm != 0:
-            self.vx, self.vy = (self.speed * x_diff / norm, self.speed * y_diff / norm)
-            self.rect.move_ip(self.vx, self.vy)
+    def step_table(self, speed: int) -> list[tuple[float, float]]:
+        """
+        速さspeedの敵機がマスごとに1回で進む量の表を返す（作り直すまで使い回す）
+        引数 speed：敵機の速さ
+        戻り値：マスごとの(x方向, y方向)の移動量のリスト
+        """
+        table = self.steps.get(speed)
+        if table is None:
+            table = self.steps[speed] = [(speed * vx, speed * vy) for vx, vy in self.dirs]
+        return table
+
+    def move(self, group: pg.sprite.AbstractGroup):
+        """
+        グループの敵機をフィールドに沿って1回分進める（敵機ごとの平方根・三角関数の計算はしない）
+        引数 group：敵機のグループ（rect，speed，facing_imgsを持つスプライト）
+        """
+        cell, facings = self.cell, self.facings
+        if not self.separation:
+            # 分離なし：マスの番号を表で引いて，速さごとの移動量の表の値だけ動かす
+            steps, col_of, row_of, m = self.steps, self.col_of, self.row_of, self.margin
+            xmax, ymax = WIDTH + m, HEIGHT + m
+            for sprite in group.sprites():
+                rect = sprite.rect
+                x, y = rect.center
+                if -m <= x < xmax and -m <= y < ymax:
+                    i = col_of[x + m] + row_of[y + m]
+                else:
+                    i = cell(x, y)
+                table = steps.get(sprite.speed) or self.step_table(sprite.speed)
+                rect.move_ip(table[i])
+                sprite.image = sprite.facing_imgs[facings[i]]
+            return
+
+        cols, rows, sep, dirs = self.cols, self.rows, self.separation, self.dirs
+        sprites = group.sprites()
+        cells = [cell(*sprite.rect.center) for sprite in sprites]
+        counts = [0] * (cols * rows)  # マスごとの敵機の数
+        for i in cells:
+            counts[i] += 1
+        pushed = {}  # 敵機のいるマスごとの，押し出しを加えた方向（同じマスの敵機で使い回す）
+        for sprite, i in zip(sprites, cells):
+            v = pushed.get(i)
+            if v is None:
+                # 左右・上下のマスの数の差の分だけ，空いている方へ押し出す
+                col, row = i % cols, i // cols
+                left = counts[i - 1] if col > 0 else 0
+                right = counts[i + 1] if col < cols - 1 else 0
+                up = counts[i - cols] if row > 0 else 0
+                down = counts[i + cols] if row < rows - 1 else 0
+                total = left + right + up + down + counts[i]
+                vx, vy = dirs[i]
+                v = pushed[i] = (vx + sep * (left - right) / total, vy + sep * (up - down) / total)
+            speed = sprite.speed
+            sprite.rect.move_ip(speed * v[0], speed * v[1])
+            sprite.image = sprite.facing_imgs[facings[i]]
+
+
+class WaveScheduler:
+    """
+    ウェーブの表に従って，敵機をまとめて出現させるクラス
+    敵機の生成はすべてspawn()を通り，プールで再利用する
+    """
+    def __init__(self, bird: Bird, group: pg.sprite.AbstractGroup, grid: SpatialHash, waves: list[dict] = WAVES):
+        """
+        引数1 bird：敵機が追いかけるこうかとん（レベルで難しさが変わる）
+        引数2 group：敵機のグループ
+        引数3 grid：敵機を登録する空間ハッシュ
+        引数4 waves：ウェーブの表
+        """
+        self.bird = bird
+        self.group = group
+        self.grid = grid
+        self.waves = waves
+        self.pool = SpritePool(Enemy)
+        self.spawned = 0  # 出現させた敵機の総数
+        self.capped = 0  # 上限に達したため出現させなかった敵機の総数
+
+    def wave(self, tmr: int) -> dict:
+        """
+        今のウェーブの行を返す
+        引数 tmr：開始からの更新回数
+        戻り値：ウェーブの表の行
+        """
+        current = self.waves[0]
+        for row in self.waves:
+            if self.bird.level >= row["level"] or tmr >= row["after"] * FPS:
+                current = row
+        return current
+
+    def update(self, tmr: int) -> int:
+        """
+        出現のタイミングなら，上限を超えない数だけ敵機をまとめて出現させる
+        引数 tmr：開始からの更新回数
+        戻り値：出現させた敵機の数
+        """
+        row = self.wave(tmr)
+        if tmr % row["interval"] != 0:
+            return 0
+        count = max(0, min(row["batch"], row["cap"] - len(self.group)))
+        self.capped += row["batch"] - count
+        self.spawn(count, row)
+        return count
+
+    def spawn(self, count: int, row: dict | None = None) -> list[Enemy]:
+        """
+        敵機をcount体出現させる（上限は確認しない）
+        引数1 count：出現させる数
+        引数2 row：種類の比率と速さを決めるウェーブの行（Noneなら最初の行）
+        戻り値：出現させた敵機のリスト
+        """
+        row = self.waves[0] if row is None else row
+        names = random.choices(list(row["mix"]), weights=list(row["mix"].values()), k=count)
+        enemies = [self.pool.acquire(self.bird, name, row["speed"]) for name in names]
+        self.grid.add(self.group, *enemies)
+        self.spawned += count
+        return enemies
+
+
+class GlyphCache:
+    """
+    文字ごとに描画したSurfaceをキャッシュし，文字列のSurfaceを組み立てるクラス
+    数字のように同じ文字が繰り返し現れる表示で，font.renderを呼ばずに済ませる
+    """
+    def __init__(self, font: pg.font.Font, color: tuple[int, int, int], antialias: bool = True):
+        """
+        引数1 font：フォント
+        引数2 color：文字色
+        引数3 antialias：アンチエイリアスをかけるか
+        """
+        self.font = font
+        self.color = color
+        self.antialias = antialias
+        self.glyphs: dict[str, pg.Surface] = {}
+        self.renders = 0  # font.renderを呼んだ回数
+
+    def glyph(self, ch: str) -> pg.Surface:
+        """
+        1文字分のSurfaceを返す（初回のみ描画する）
+        引数 ch：文字
+        戻り値：文字のSurface
+        """
+        if ch not in self.glyphs:
+            self.glyphs[ch] = self.font.render(ch, self.antialias, self.color).convert_alpha()
+            self.renders += 1
+        return self.glyphs[ch]
+
+    def render(self, text: str) -> pg.Surface:
+        """
+        キャッシュした文字を並べて文字列のSurfaceを作る
+        引数 text：文字列
+        戻り値：文字列のSurface（透過）
+        """
+        glyphs = [self.glyph(ch) for ch in text]
+        img = pg.Surface((sum(g.get_width() for g in glyphs), self.font.get_height()), pg.SRCALPHA)
+        x = 0
+        for g in glyphs:
+            img.blit(g, (x, 0))
+            x += g.get_width()
+        return img
 
 
 class Score:
@@ -394,225 +1699,1618 @@ class Score:
     def __init__(self):
         self.font = pg.font.Font(None, 50)
         self.color = (0, 0, 255)
+        self.glyphs = GlyphCache(self.font, self.color, False)
         self.value = 0
-        self.image = self.font.render(f"Score: {self.value}", 0, self.color)
+        self.shown = self.value  # 現在のimageに描かれている値
+        self.image = self.glyphs.render(f"Score: {self.value}")
         self.rect = self.image.get_rect()
         self.rect.center = 100, HEIGHT-50
 
-    def update(self, screen: pg.Surface):
-        self.image = self.font.render(f"Score: {self.value}", 0, self.color)
-        screen.blit(self.image, self.rect)
+    def update(self, screen: pg.Surface) -> pg.Rect:
+        """
+        スコアを画面に表示する（値が変わった時だけ文字列を組み立て直す）
+        引数 screen：画面Surface
+        戻り値：描画した範囲のRect
+        """
+        if self.value != self.shown:
+            self.image = self.glyphs.render(f"Score: {self.value}")
+            self.rect = self.image.get_rect(midleft=self.rect.midleft)
+            self.shown = self.value
+        return screen.blit(self.image, self.rect)
+
+
+class Hud:
+    """
+    レベル表示と経験値ゲージを1枚のSurfaceにまとめてキャッシュし，
+    スコアと合わせて画面に表示するクラス
+    値が変わらないフレームでは文字の描画を一切行わない
+    """
+    pos = (50, 50)  # レベル表示の左上座標
+    bar_width = 400
+    bar_height = 20
+    bar_top = 50  # レベル表示の上端からゲージの上端までの距離
+
+    def __init__(self, bird: Bird, score: Score):
+        """
+        引数1 bird：レベルと経験値を持つこうかとん
+        引数2 score：スコア
+        """
+        self.bird = bird
+        self.score = score
+        self.glyphs = GlyphCache(pg.font.Font(None, 50), (0, 255, 0))
+        self.panel = pg.Surface((self.bar_width, self.bar_top + self.bar_height), pg.SRCALPHA)
+        self.shown: tuple[int, int, int] | None = None  # 現在のpanelに描かれている(レベル, 経験値, 必要経験値)
+        self.composes = 0  # panelを組み立て直した回数
+
+    def compose(self):
+        """
+        レベル表示と経験値ゲージをpanelに描き直す
+        """
+        bird = self.bird
+        self.panel.fill((0, 0, 0, 0))
+        self.panel.blit(self.glyphs.render(f"Level: {bird.level}"), (0, 0))
+        filled_bar_width = int(self.bar_width * bird.experience / bird.exp_to_next_level)
+        # 背景のグレーのバーは変化しないので，Backgroundに焼き込んである（draw_track）
+        # 埋まっている部分
+        pg.draw.rect(self.panel, (0, 255, 0), (0, self.bar_top, filled_bar_width, self.bar_height)) # 緑
+        self.shown = (bird.level, bird.experience, bird.exp_to_next_level)
+        self.composes += 1
+
+    @classmethod
+    def draw_track(cls, surface: pg.Surface) -> pg.Rect:
+        """
+        経験値ゲージの背景のバー（変化しない部分）を描画する
+        引数 surface：描画先（通常は背景Surface）
+        戻り値：描画した範囲のRect
+        """
+        return pg.draw.rect(surface, (128, 128, 128), (cls.pos[0], cls.pos[1] + cls.bar_top, cls.bar_width, cls.bar_height)) # グレー
+
+    def draw(self, screen: pg.Surface) -> list[pg.Rect]:
+        """
+        HUDを画面に描画する
+        引数 screen：画面Surface
+        戻り値：描画した範囲のRectのリスト
+        """
+        bird = self.bird
+        if self.shown != (bird.level, bird.experience, bird.exp_to_next_level):
+            self.compose()
+        return [screen.blit(self.panel, self.pos), self.score.update(screen)]
 
 class Gravity(pg.sprite.Sprite):
+    """
+    画面全体の敵機・爆弾を消す重力場クラス
+    暗くする半透明の画像は全インスタンスで1枚を共有し，発動のたびに画面サイズのSurfaceを作らない
+    """
+    overlay: pg.Surface | None = None  # 共有の半透明画像
+    damage = Damage("gravity", blast=50)  # 重力場で倒した時の爆発は短い
+
     def __init__(self, life:int):
         super().__init__()
-        self.image = pg.Surface((WIDTH, HEIGHT))
-        pg.draw.rect(self.image, (0, 0, 0), (0, 0, WIDTH, HEIGHT))
+        if Gravity.overlay is None:
+            Gravity.overlay = pg.Surface((WIDTH, HEIGHT))
+            Gravity.overlay.set_alpha(120)
+        self.image = Gravity.overlay
         self.rect = self.image.get_rect()
         self.life = life
-        self.image.set_alpha(120)
-        
-    
+
+    def hit(self, rct: pg.Rect) -> bool:
+        """
+        重力場の範囲（画面内）にRectが入っているかを判定する
+        引数 rct：判定するRect
+        戻り値：入っていればTrue
+        """
+        return self.rect.colliderect(rct)
+
     def update(self):
         self.life -= 1
         if self.life < 0:
             self.kill()
 
-class RollBlade(pg.sprite.Sprite):
-    def __init__(self, bird: Bird, num):
-        super().__init__()
+class RollBlade:
+    """
+    こうかとんの周りを回る回転刃（複数枚）を扱うクラス
+    全刃の位置は1回のループで角度の表を引いて求め（三角関数は使わない），刃ごとの当たり判定用スプライトのrectに書き込む
+    描画は全刃で共有の回転キャッシュから，更新で求めた位置に転送するだけにする
+    """
+    damage = Damage("blade")  # 倒した相手の報酬の補正
+    units = [(math.cos(math.radians(a)), math.sin(math.radians(a))) for a in range(360)]  # 1度ごとの単位ベクトル
+
+    def __init__(self, bird: Bird, group: pg.sprite.AbstractGroup, levels: list[tuple[int, int]] = BLADE_LEVELS):
+        """
+        引数1 bird：回転の中心になるこうかとん
+        引数2 group：刃ごとの当たり判定用スプライトを入れるグループ
+        引数3 levels：回転刃の枚数の表（こうかとんのレベル, 枚数）
+        """
         self.bird = bird
-        self.blade_count = num
-        self.speed = 3
+        self.group = group
+        self.levels = levels
+        self.stride = 1  # 何枚おきに描画するか（描画品質を下げたときに増やす，当たり判定は変えない）
+        self.draw_step: float | None = None  # 描画する回転画像の角度の刻み幅（Noneなら回転キャッシュの既定値）
+        self.speed = 3  # 1回の更新で回る角度[度]
         self.radius = 100
         self.angle = 0
-        self.size = 75
-        
+        self.rotations = Assets.rotations("blade", smooth=False)  # 全刃で共有の回転画像キャッシュ
+        self.hits: list[pg.sprite.Sprite] = []  # 刃ごとの当たり判定用スプライト
+        self.offsets: list[int] = []  # 刃ごとの角度のずれ[度]
+        self.centers: list[tuple[float, float]] = []  # 刃ごとのこうかとんの中心からの位置
+        self.level = None  # 枚数を決めたときのこうかとんのレベル
+        self.fit_level()
+
+    @property
+    def blade_count(self) -> int:
+        """
+        今の回転刃の枚数
+        """
+        return len(self.hits)
 
-        self.original_image = pg.image.load("fig/blade.png").convert_alpha()
-        self.image = pg.transform.scale(self.original_image, (self.size, self.size))
-        self.rect = self.original_image.get_rect()
+    def set_count(self, num: int):
+        """
+        回転刃の枚数を変える（当たり判定用スプライトを足すか減らし，角度のずれを等間隔に振り直す）
+        引数 num：枚数
+        """
+        size = self.rotations.image.get_size()
+        while len(self.hits) < num:
+            hit = pg.sprite.Sprite()
+            hit.rect = pg.Rect((0, 0), size)  # 回転しても当たり判定の大きさは変えない
+            self.hits.append(hit)
+            self.group.add(hit)
+        while len(self.hits) > num:
+            self.hits.pop().kill()
+        self.offsets = [round(360 * i / num) for i in range(num)]
+        self.update_positions()
+
+    def fit_level(self):
+        """
+        こうかとんのレベルが変わっていれば，枚数の表に従って枚数を合わせる
+        """
+        if self.bird.level == self.level:
+            return
+        self.level = self.bird.level
+        count = self.levels[0][1]
+        for level, num in self.levels:
+            if self.level >= level:
+                count = num
+        if count != self.blade_count:
+            self.set_count(count)
 
     def update(self):
+        """
+        レベルに応じて枚数を合わせ，1回分回転させる
+        """
+        self.fit_level()
         self.angle = (self.angle + self.speed) % 360
         self.update_positions()
 
     def update_positions(self):
-        for i in range(self.blade_count):
-            angle_offset = 360 / self.blade_count * i
-            rad_angle = math.radians(self.angle + angle_offset)
-            blade_rect = self.image.get_rect()
-            blade_rect.center = (
-                self.bird.rect.centerx + self.radius * math.cos(rad_angle),
-                self.bird.rect.centery + self.radius * math.sin(rad_angle)
-            )
-            self.image = pg.transform.rotate(self.original_image, -(self.angle + angle_offset))
-            self.rect = blade_rect
-
-    def draw(self, screen):
-        for i in range(self.blade_count):
-            angle_offset = 360 / self.blade_count * i
-            rad_angle = math.radians(self.angle + angle_offset)
-            blade_rect = self.image.get_rect()
-            blade_rect.center = (
-                self.bird.rect.centerx + self.radius * math.cos(rad_angle),
-                self.bird.rect.centery + self.radius * math.sin(rad_angle)
-            )
-            rotated_image = pg.transform.rotate(self.original_image, -(self.angle + angle_offset))
-            screen.blit(rotated_image, blade_rect)
+        """
+        全刃の位置を求め，当たり判定用スプライトのrectを動かす
+        """
+        units, angle, radius = self.units, self.angle, self.radius
+        cx, cy = self.bird.rect.center
+        self.centers = []
+        for hit, offset in zip(self.hits, self.offsets):
+            ux, uy = units[(angle + offset) % 360]
+            x, y = radius * ux, radius * uy
+            self.centers.append((x, y))
+            hit.rect.center = cx + x, cy + y
+
+    def draw(self, screen: pg.Surface, offset: tuple[int, int] = (0, 0)) -> list[pg.Rect]:
+        """
+        更新で求めた位置に，回転キャッシュの画像で全刃を描画する
+        引数1 screen：画面Surface
+        引数2 offset：補間で描画位置をずらす量
+        戻り値：描画した範囲のRectのリスト
+        """
+        cx, cy = self.bird.rect.centerx + offset[0], self.bird.rect.centery + offset[1]
+        seq = []
+        for i in range(0, len(self.centers), self.stride):
+            img, (dx, dy) = self.rotations.get(-(self.angle + self.offsets[i]), self.draw_step)
+            x, y = self.centers[i]
+            seq.append((img, (cx + x + dx, cy + y + dy)))
+        return screen.blits(seq)
+
+
+class TrackedGroup(pg.sprite.Group):
+    """
+    スプライトの追加・削除（killを含む）をMotionEngineに知らせるスプライトグループ
+    エンジンは出現・killのときだけ添字を登録・解除し，毎フレームグループを走査しない
+    """
+    engine: "MotionEngine | None" = None  # MotionEngine.trackで設定される
+
+    def add_internal(self, sprite: pg.sprite.Sprite, layer=None):
+        super().add_internal(sprite, layer)
+        if self.engine is not None:
+            self.engine.enter(self, sprite)
+
+    def remove_internal(self, sprite: pg.sprite.Sprite):
+        super().remove_internal(sprite)
+        if self.engine is not None:
+            self.engine.leave(sprite)
+
+
+class MotionEngine:
+    """
+    敵機・爆弾の位置と速度をNumPy配列（Struct of Arrays）で持ち，
+    ホーミング・移動・画面外判定をまとめてベクトル演算するクラス
+    スプライトはTrackedGroupへの追加・削除のときに登録・解除し，
+    描画と衝突判定に使うrectとimageは，計算結果から毎フレーム書き戻す
+    """
+    facings = ("left", "right", "up", "down")  # Enemy.facing_imgsのキー
+
+    def __init__(self, capacity: int = 256):
+        """
+        引数 capacity：最初に確保する配列の要素数（足りなくなったら倍に拡張する）
+        """
+        if np is None:
+            raise RuntimeError("MotionEngineにはNumPyが必要です")
+        self.pos = np.zeros((capacity, 2))  # 中心座標
+        self.vel = np.zeros((capacity, 2))  # 単位方向ベクトル
+        self.speed = np.zeros(capacity)  # 1フレームあたりの移動量
+        self.half = np.zeros((capacity, 2))  # Rectの幅・高さの半分（画面外判定用）
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.homing = np.zeros(capacity, dtype=bool)  # Trueなら目標に向かって進む
+        self.cull = np.zeros(capacity, dtype=bool)  # Trueなら画面外に出たらkillする
+        self.facing = np.full(capacity, -1, dtype=np.int8)  # ホーミング体の向き（facingsの添字）
+        self.sprites: list[pg.sprite.Sprite | None] = [None] * capacity
+        self.rects: list[pg.Rect | None] = [None] * capacity  # sprites[i].rect（書き戻し用）
+        self.slots: dict[pg.sprite.Sprite, int] = {}  # スプライトと配列の添字の辞書
+        self.free = list(range(capacity - 1, -1, -1))
+        self.tracked: dict[TrackedGroup, tuple[type, bool, bool]] = {}
+        self.others: dict[pg.sprite.Sprite, None] = {}  # 登録したグループにいる，エンジンで動かさないスプライト
+
+    def track(self, group: TrackedGroup, kind: type, homing: bool = False, cull: bool = True):
+        """
+        グループ内のkindのスプライトをエンジンで動かすように登録する（今いるスプライトも登録する）
+        kind以外のスプライトは従来どおりupdate()を呼ぶ
+        引数1 group：対象のグループ
+        引数2 kind：エンジンで動かすスプライトのクラス
+        引数3 homing：Trueなら毎フレーム目標の方向へ向きを変える
+        引数4 cull：Trueなら画面外に出たらkillする
+        """
+        self.tracked[group] = kind, homing, cull
+        group.engine = self
+        for sprite in group.sprites():
+            self.enter(group, sprite)
+
+    def enter(self, group: TrackedGroup, sprite: pg.sprite.Sprite):
+        """
+        登録済みのグループにスプライトが追加された時に呼ばれる
+        引数1 group：追加先のグループ
+        引数2 sprite：追加されたスプライト
+        """
+        kind, homing, cull = self.tracked[group]
+        if isinstance(sprite, kind):
+            self.add(sprite, homing, cull)
+        else:
+            self.others[sprite] = None
+
+    def leave(self, sprite: pg.sprite.Sprite):
+        """
+        登録済みのグループからスプライトが削除された（killされた）時に呼ばれる
+        引数 sprite：削除されたスプライト
+        """
+        i = self.slots.get(sprite)
+        if i is not None:
+            self.remove(i)
+        else:
+            self.others.pop(sprite, None)
+
+    def grow(self):
+        """
+        配列の容量を倍に拡張する
+        """
+        old = len(self.alive)
+        self.pos = np.concatenate([self.pos, np.zeros((old, 2))])
+        self.vel = np.concatenate([self.vel, np.zeros((old, 2))])
+        self.speed = np.concatenate([self.speed, np.zeros(old)])
+        self.half = np.concatenate([self.half, np.zeros((old, 2))])
+        self.alive = np.concatenate([self.alive, np.zeros(old, dtype=bool)])
+        self.homing = np.concatenate([self.homing, np.zeros(old, dtype=bool)])
+        self.cull = np.concatenate([self.cull, np.zeros(old, dtype=bool)])
+        self.facing = np.concatenate([self.facing, np.full(old, -1, dtype=np.int8)])
+        self.sprites.extend([None] * old)
+        self.rects.extend([None] * old)
+        self.free.extend(range(2 * old - 1, old - 1, -1))
+
+    def add(self, sprite: pg.sprite.Sprite, homing: bool, cull: bool):
+        """
+        スプライトを空いている添字に登録する
+        引数1 sprite：登録するスプライト（rect，speedを持ち，ホーミングでなければvx，vyも持つ）
+        引数2 homing：ホーミングするか
+        引数3 cull：画面外に出たらkillするか
+        """
+        if not self.free:
+            self.grow()
+        i = self.free.pop()
+        self.pos[i] = sprite.rect.center
+        self.vel[i] = (0, 0) if homing else (sprite.vx, sprite.vy)
+        self.speed[i] = sprite.speed
+        self.half[i] = sprite.rect.width / 2, sprite.rect.height / 2
+        self.alive[i] = True
+        self.homing[i] = homing
+        self.cull[i] = cull
+        self.facing[i] = -1
+        self.sprites[i] = sprite
+        self.rects[i] = sprite.rect
+        self.slots[sprite] = i
+
+    def remove(self, i: int):
+        """
+        添字iのスプライトの登録を解除する
+        引数 i：配列の添字
+        """
+        del self.slots[self.sprites[i]]
+        self.sprites[i] = None
+        self.rects[i] = None
+        self.alive[i] = False
+        self.free.append(i)
+
+    def step(self, target: tuple[int, int]):
+        """
+        全スプライトを1フレーム分進め，結果をrect（とEnemyのimage）に書き戻す
+        エンジンの対象外のスプライトはupdate()で動かす
+        引数 target：ホーミングの目標座標（こうかとんの中心）
+        """
+        for sprite in list(self.others):
+            sprite.update()
+        alive = self.alive
+        homing = alive & self.homing
+        diff = np.asarray(target, dtype=float) - self.pos
+        norm = np.hypot(diff[:, 0], diff[:, 1])
+        steer = homing & (norm != 0)
+        self.vel[steer] = diff[steer] / norm[steer, None]
+        moving = alive & (~self.homing | steer)
+        self.pos[moving] += self.vel[moving] * self.speed[moving, None]
+
+        # 画面外判定（check_boundと同じ条件）
+        lo = self.pos - self.half
+        hi = self.pos + self.half
+        out = alive & self.cull & ((lo[:, 0] < 0) | (hi[:, 0] > WIDTH) | (lo[:, 1] < 0) | (hi[:, 1] > HEIGHT))
+
+        # ホーミング体の向き：横移動が大きければ左右，縦移動が大きければ上下
+        facing = np.where(np.abs(diff[:, 0]) > np.abs(diff[:, 1]),
+                          np.where(diff[:, 0] > 0, 1, 0),
+                          np.where(diff[:, 1] < 0, 2, 3)).astype(np.int8)
+        turned = homing & (facing != self.facing)
+        self.facing[turned] = facing[turned]
+
+        # スプライトへの書き戻し（画面外に出たものはkillし，killでleave()が呼ばれて登録も解除される）
+        for i in np.flatnonzero(out).tolist():
+            self.sprites[i].kill()
+        active = np.flatnonzero(self.alive)
+        centers = np.rint(self.pos[active]).astype(int)
+        # 1体ずつのPythonのループを使わず，map()で全rectのcenterx，centeryに代入する
+        # （座標をタプルにまとめないので，1体ごとのコンテナの生成とgcの負担が無い）
+        rects = list(map(self.rects.__getitem__, active.tolist()))
+        deque(map(setattr, rects, repeat("centerx"), centers[:, 0].tolist()), maxlen=0)
+        deque(map(setattr, rects, repeat("centery"), centers[:, 1].tolist()), maxlen=0)
+        for i in np.flatnonzero(turned & self.alive).tolist():
+            sprite = self.sprites[i]
+            sprite.image = sprite.facing_imgs[__class__.facings[self.facing[i]]]
+
+
+class PhaseTimer:
+    """
+    1フレーム内の処理区間（フェーズ）ごとの経過時間を計測するクラス
+    """
+    def __init__(self):
+        self.times: dict[str, float] = {}  # フェーズ名と経過時間[ms]の辞書（直近1フレーム分）
+        self.last = time.perf_counter()
+
+    def start(self):
+        """
+        フレームの計測を開始する
+        """
+        self.times = {}
+        self.last = time.perf_counter()
+
+    def mark(self, name: str):
+        """
+        前回の区切りからの経過時間をフェーズnameの時間として記録する
+        引数 name：フェーズ名
+        """
+        now = time.perf_counter()
+        self.times[name] = self.times.get(name, 0.0) + (now - self.last) * 1000
+        self.last = now
+
+
+class Background:
+    """
+    背景画像と変化しないHUDの部品を，画面と同じ大きさ・表示形式のSurfaceに一度だけ合成して保持するクラス
+    mode="cover"なら画像を画面全体を覆う大きさに拡大縮小して中央を切り出し，
+    mode="tile"なら画像を並べて敷き詰める．scrollを指定すると更新ごとにずらして表示する
+    """
+    def __init__(self, name: str = "aozora", mode: str = "cover", scroll: tuple[float, float] = (0, 0),
+                 tile_scale: float = 1.0, static_layers: tuple = (Hud.draw_track,)):
+        """
+        引数1 name：背景の画像名
+        引数2 mode："cover"（画面を覆うように拡大縮小）か"tile"（敷き詰め）
+        引数3 scroll：更新1回あたりのずらす量[px]（(0, 0)ならスクロールしない）
+        引数4 tile_scale："tile"のときの画像の拡大率
+        引数5 static_layers：背景の上に重ねる変化しない部品を描く関数（Surfaceを受け取る）のタプル
+        """
+        src = Assets.get(name)
+        if mode == "cover":
+            ratio = max(WIDTH / src.get_width(), HEIGHT / src.get_height())
+            w, h = math.ceil(src.get_width() * ratio), math.ceil(src.get_height() * ratio)
+            tile = pg.Surface((WIDTH, HEIGHT))
+            tile.blit(pg.transform.smoothscale(src, (w, h)), ((WIDTH - w) // 2, (HEIGHT - h) // 2))
+        elif mode == "tile":
+            tile = pg.transform.smoothscale(src, (round(src.get_width() * tile_scale), round(src.get_height() * tile_scale)))
+        else:
+            raise ValueError(f"未知の背景モード：{mode}")
+        self.tile_size = tile.get_size()
+        self.scroll = scroll
+        self.offset = [0.0, 0.0]
+        self.static_layers = static_layers
+        # スクロールするときは，1枚分ずらしても画面が埋まるように1枚分大きく敷き詰める
+        tw, th = self.tile_size
+        size = (WIDTH + tw, HEIGHT + th) if self.scrolling else (WIDTH, HEIGHT)
+        self.surface = pg.Surface(size).convert()  # 画面と同じ表示形式にして，転送時の変換をなくす
+        for x in range(0, size[0], tw):
+            for y in range(0, size[1], th):
+                self.surface.blit(tile, (x, y))
+        if not self.scrolling:
+            for layer in static_layers:
+                layer(self.surface)
+
+    @property
+    def scrolling(self) -> bool:
+        return self.scroll != (0, 0)
+
+    def update(self):
+        """
+        スクロールのずれを更新1回分進める
+        """
+        tw, th = self.tile_size
+        self.offset[0] = (self.offset[0] + self.scroll[0]) % tw
+        self.offset[1] = (self.offset[1] + self.scroll[1]) % th
+
+    def restore(self, screen: pg.Surface, rect: pg.Rect | None = None):
+        """
+        画面の指定範囲（Noneなら全体）を背景で描き直す
+        引数1 screen：画面Surface
+        引数2 rect：描き直す範囲
+        """
+        if self.scrolling:  # スクロール中は常に画面全体を描き直す
+            screen.blit(self.surface, (0, 0), (int(self.offset[0]), int(self.offset[1]), WIDTH, HEIGHT))
+            for layer in self.static_layers:
+                layer(screen)
+        elif rect is None:
+            screen.blit(self.surface, (0, 0))
+        else:
+            screen.blit(self.surface, rect, rect)
+
+
+class DirtyRenderer:
+    """
+    前フレームと今フレームに描画した範囲だけを背景で消し，ディスプレイに転送するクラス
+    dirty=Falseなら従来どおり毎フレーム画面全体を描き直して転送する
+    """
+    max_rects = 300  # これより描画範囲が多いフレームは画面全体を転送する
+    # 消す範囲の面積の合計が画面のこの割合を超えたら，画面全体を1回で描き直す
+    # （小さな範囲の転送は1画素あたりが割高で，60px四方を約50個消すと画面全体の描き直しより遅い）
+    max_restore_area = 0.2
+
+    def __init__(self, screen: pg.Surface, background: Background, dirty: bool = True):
+        """
+        引数1 screen：画面Surface
+        引数2 background：背景
+        引数3 dirty：Trueなら差分描画，Falseなら全画面描画
+        """
+        self.screen = screen
+        self.background = background
+        self.dirty = dirty
+        self.prev: list[pg.Rect] = []  # 前フレームに描画した範囲
+        self.curr: list[pg.Rect] = []  # 今フレームに描画した範囲
+        self.full = True  # Trueなら次のフレームは画面全体を描き直す
+
+    def begin(self):
+        """
+        フレームの描画を始める（前フレームに描画した範囲を背景で消す）
+        """
+        if self.background.scrolling:  # スクロールする背景は毎フレーム画面全体が変わる
+            self.full = True
+        if self.full or not self.dirty or len(self.prev) > self.max_rects:
+            self.background.restore(self.screen)
+            return
+        area = 0
+        for rect in self.prev:
+            area += rect.w * rect.h
+        if area > WIDTH * HEIGHT * self.max_restore_area:
+            self.background.restore(self.screen)
+        else:
+            surface = self.background.surface
+            self.screen.blits([(surface, rect, rect) for rect in self.prev], doreturn=False)
+
+    def add(self, rects: pg.Rect | list[pg.Rect]):
+        """
+        今フレームに描画した範囲を登録する
+        引数 rects：描画した範囲のRect，またはそのリスト
+        """
+        if isinstance(rects, pg.Rect):
+            self.curr.append(rects)
+        else:
+            self.curr.extend(rects)
+
+    def blit_group(self, group: pg.sprite.AbstractGroup, prev: dict[pg.sprite.Sprite, tuple[int, int]] | None = None,
+                   alpha: float = 1.0, rotations: RotationCache | None = None, step: float | None = None):
+        """
+        グループのスプライトを描画し，その範囲を登録する
+        引数1 group：描画するグループ
+        引数2 prev：スプライトと前回の更新時の中心座標の辞書（Noneなら補間しない）
+        引数3 alpha：前回から今回の位置への補間の割合（1.0なら今回の位置）
+        引数4 rotations：指定するとimageの代わりに，このキャッシュのsprite.angleの画像をrectの中心に描画する
+        引数5 step：rotationsの画像の角度の刻み幅（描画品質を下げたとき）
+        """
+        if rotations is None and (prev is None or alpha >= 1.0):
+            self.curr.extend(self.screen.blits([(sprite.image, sprite.rect) for sprite in group]))
+            return
+        seq = []
+        back = 1.0 - alpha
+        for sprite in group:
+            rect = sprite.rect
+            old = prev.get(sprite) if prev is not None and alpha < 1.0 else None
+            if old is not None:
+                rect = rect.move(round((old[0] - rect.centerx) * back), round((old[1] - rect.centery) * back))
+            if rotations is None:
+                seq.append((sprite.image, rect))
+            else:
+                img, (dx, dy) = rotations.get(sprite.angle, step)
+                seq.append((img, (rect.centerx + dx, rect.centery + dy)))
+        self.curr.extend(self.screen.blits(seq))
+
+    def flush(self) -> list[pg.Rect] | None:
+        """
+        フレームの描画を終える
+        戻り値：pg.display.update()に渡す範囲のリスト（Noneなら画面全体を転送する）
+        """
+        if self.full or not self.dirty or len(self.prev) + len(self.curr) > self.max_rects:
+            dirty = None
+        else:
+            dirty = self.prev + self.curr
+        self.full = False
+        self.prev, self.curr = self.curr, []
+        return dirty
+
+
+class FrameProfiler:
+    """
+    フレームごとのフェーズ別処理時間とスプライト数を記録し，
+    画面右上への推移グラフ表示と，CSV/JSON Lines形式のトレース出力を行うクラス
+    """
+    budget_ms = 1000 / FPS  # 1フレームに使える時間[ms]
+    # PhaseTimer.markのフェーズ名とGame.countsのグループ名（更新が0回のフレームやF3を押す前もトレースの列をそろえる）
+    phase_names = ("input", "spawn", "collision", "update", "background", "draw", "overlay", "display")
+    count_names = ("emys", "beams", "bombs", "exps", "gravities", "lasers")
+    columns = ("frame", "frame_ms", *(f"{name}_ms" for name in phase_names), *count_names, "note")  # CSVのヘッダー
+
+    def __init__(self, history: int = 240, trace_path: str | None = None):
+        """
+        引数1 history：グラフに表示するフレーム数
+        引数2 trace_path：トレースの出力先（拡張子が.jsonlならJSON Lines，それ以外はCSV，Noneなら出力しない）
+        """
+        self.enabled = False  # Trueなら画面にオーバーレイを表示する
+        self.frame_ms: deque[float] = deque(maxlen=history)  # 1フレームの処理時間[ms]の履歴
+        self.sprites: deque[int] = deque(maxlen=history)  # 総スプライト数の履歴
+        self.phases: dict[str, float] = {}  # 直近のフェーズ別処理時間[ms]（指数移動平均）
+        self.counts: dict[str, int] = {}  # 直近のグループ別スプライト数
+        self.last_note = ""  # 直近の出来事（描画品質の変更など，オーバーレイに表示する）
+        self.pending_note = ""  # 次に記録するトレースの行に書く出来事
+        self.font = pg.font.Font(None, 20)
+        self.panel = pg.Surface((360, 190), pg.SRCALPHA)
+        self.panel_rect = self.panel.get_rect(topright=(WIDTH - 10, 10))
+        self.trace_file = None
+        self.trace_writer = None
+        if trace_path is not None:
+            self.trace_file = open(trace_path, "w", newline="")
+            self.jsonl = trace_path.endswith(".jsonl")
+
+    @property
+    def active(self) -> bool:
+        """
+        オーバーレイ表示かトレース出力のどちらかが有効ならTrue
+        """
+        return self.enabled or self.trace_file is not None
+
+    def note(self, text: str):
+        """
+        出来事（描画品質の変更など）を記録する．オーバーレイに表示し，トレースの次の行のnote列に書く
+        引数 text：出来事の説明
+        """
+        self.last_note = text
+        self.pending_note = f"{self.pending_note}; {text}" if self.pending_note else text
+
+    def record(self, frame: int, phases: dict[str, float], counts: dict[str, int], frame_ms: float):
+        """
+        1フレーム分の計測結果を記録する
+        引数1 frame：フレーム番号
+        引数2 phases：フェーズ名と処理時間[ms]の辞書
+        引数3 counts：グループ名とスプライト数の辞書
+        引数4 frame_ms：フレーム全体の処理時間[ms]（待ち時間を除く）
+        """
+        self.frame_ms.append(frame_ms)
+        self.sprites.append(sum(counts.values()))
+        for name, ms in phases.items():
+            self.phases[name] = self.phases.get(name, ms) * 0.9 + ms * 0.1
+        self.counts = counts
+        if self.trace_file is None:
+            return
+        row = {"frame": frame, "frame_ms": round(frame_ms, 4)}
+        row.update({f"{name}_ms": round(ms, 4) for name, ms in phases.items()})
+        row.update(counts)
+        if self.pending_note:
+            row["note"] = self.pending_note
+            self.pending_note = ""
+        if self.jsonl:
+            self.trace_file.write(json.dumps(row) + "\n")
+        else:
+            if self.trace_writer is None:  # そのフレームで計測しなかったフェーズは空欄にする
+                self.trace_writer = csv.DictWriter(self.trace_file, fieldnames=self.columns, restval="")
+                self.trace_writer.writeheader()
+            self.trace_writer.writerow(row)
+
+    def draw(self, screen: pg.Surface) -> pg.Rect:
+        """
+        処理時間とスプライト数の推移グラフ，フェーズ別の内訳を画面右上に描画する
+        引数 screen：画面Surface
+        戻り値：描画した範囲のRect
+        """
+        panel = self.panel
+        w, h = panel.get_size()
+        graph_h = 80
+        panel.fill((0, 0, 0, 160))
+        # 予算（1フレームの時間）の線を高さの半分に引き，縦軸は予算の2倍まで
+        pg.draw.line(panel, (255, 255, 0), (0, graph_h // 2), (w, graph_h // 2))
+        n = self.frame_ms.maxlen
+        if len(self.frame_ms) >= 2:
+            scale = graph_h / (2 * self.budget_ms)
+            points = [(i * w / n, graph_h - min(ms * scale, graph_h)) for i, ms in enumerate(self.frame_ms)]
+            pg.draw.lines(panel, (255, 80, 80), False, points)
+            peak = max(max(self.sprites), 1)
+            points = [(i * w / n, graph_h - count * graph_h / peak) for i, count in enumerate(self.sprites)]
+            pg.draw.lines(panel, (80, 200, 255), False, points)
+        phases = [f"{name} {ms:.1f}" for name, ms in self.phases.items()]
+        counts = [f"{name} {count}" for name, count in self.counts.items()]
+        lines = [f"frame {self.frame_ms[-1] if self.frame_ms else 0:.1f} ms / budget {self.budget_ms:.0f} ms"]
+        lines += [" ".join(phases[i:i+4]) for i in range(0, len(phases), 4)]  # 1行に4項目ずつ
+        lines += [" ".join(counts[i:i+4]) for i in range(0, len(counts), 4)]
+        if self.last_note:
+            lines.append(self.last_note)
+        for i, text in enumerate(lines):
+            panel.blit(self.font.render(text, True, (255, 255, 255)), (4, graph_h + 4 + i * 16))
+        return screen.blit(panel, self.panel_rect)
+
+    def close(self):
+        """
+        トレースファイルを閉じる
+        """
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
 
-def main():
-    pg.display.set_caption("真！こうかとん無双")
-    screen = pg.display.set_mode((WIDTH, HEIGHT))
-    bg_img = pg.image.load(f"fig/aozora.jpg")
-    scaled_bg_img = pg.transform.scale(bg_img, (int(bg_img.get_width() * 0.7), int(bg_img.get_height() * 0.7)))
-    score = Score()
-    num = 1 #Bladeの数
-
-    bird = Bird(3, (900, 400))
-    bombs = pg.sprite.Group()
-    beams = pg.sprite.Group()
-    exps = pg.sprite.Group()
-    emys = pg.sprite.Group()
-    gravities = pg.sprite.Group()
-    blades = pg.sprite.Group()
-    blades.add(RollBlade(bird, num))
-    lasers = pg.sprite.Group()  # レーザーのグループを追加
-
-    tmr = 0
-    clock = pg.time.Clock()
 
+class MemoryTelemetry:
+    """
+    長時間の実行でのメモリの増え方を調べるため，interval回の更新ごとに
+    tracemallocで追跡したPythonのメモリ，Pythonオブジェクトの数，生きているSurfaceの画素メモリの推定値，
+    グループごとのスプライト数，プールの空きの数を記録し，時系列として出力するクラス
+    tracemallocと全オブジェクトの走査で遅くなるので，環境変数やベンチマークで明示したときだけ使う
+    traced_kbには，このクラス自身（記録した行やスナップショット）と回転キャッシュ（rotated_kbで別に数える）が確保したメモリを含めない
+    """
+    bounded = ("tick", "peak_kb", "rotated", "rotated_kb")  # 増加の判定から外す列（ピークと，角度の数で上限のある回転キャッシュ）
+    untraced = ("MemoryTelemetry", "RotationCache")  # traced_kbと増えたコードの行から除くクラス
 
-    while True:
-        key_lst = pg.key.get_pressed()
+    def __init__(self, path: str | None = None, interval: int = 500, warmup: int = 2):
+        """
+        引数1 path：時系列の出力先（拡張子が.jsonlならJSON Lines，それ以外はCSV，Noneなら出力しない）
+        引数2 interval：記録する間隔[更新回数]
+        引数3 warmup：増加の判定から外す最初の記録の数（画像のキャッシュなどが埋まるまで）
+        """
+        self.interval = interval
+        self.warmup = warmup
+        self.samples: list[dict[str, float]] = []
+        self.baseline: tracemalloc.Snapshot | None = None  # warmup後の最初の記録時点のスナップショット
+        self.started = not tracemalloc.is_tracing()  # 自分で開始したときだけ終了時に止める
+        self.excluded: set[tuple[str, int]] = set()  # untracedのクラスのソースの(ファイル名, 行)
+        for name in self.untraced:
+            source, first = inspect.getsourcelines(globals()[name])
+            filename = inspect.getsourcefile(globals()[name])
+            self.excluded.update((filename, line) for line in range(first, first + len(source)))
+        if self.started:
+            tracemalloc.start()
+        self.file = open(path, "w", newline="") if path is not None else None
+        self.jsonl = path is not None and path.endswith(".jsonl")
+        self.writer = None
+
+    @staticmethod
+    def walked(obj: object) -> bool:
+        """
+        surface_memoryで参照をたどる先のオブジェクトならTrueを返す
+        組み込みのコンテナ，スプライトとグループ，このモジュールで定義したクラスとそのインスタンスだけをたどり，
+        他のモジュールや関数の先（pygameやnumpyの内部）には入らない
+        引数 obj：対象のオブジェクト
+        戻り値：たどるならTrue
+        """
+        if isinstance(obj, (dict, list, tuple, set, frozenset, deque, pg.sprite.Sprite, pg.sprite.AbstractGroup)):
+            return True
+        if isinstance(obj, type):
+            return obj.__module__ == __name__
+        return type(obj).__module__ == __name__
+
+    @classmethod
+    def surface_memory(cls, game: "Game") -> dict[str, int]:
+        """
+        モジュールの変数（Assets.surfacesやBomb.imgsなどのクラス変数を含む）とゲームから参照をたどってSurfaceを数え，画素メモリの合計を推定する
+        gcが追跡しない辞書（キーと値が文字列・整数とSurfaceだけの辞書）に入ったSurfaceも見落とさないよう，gc.get_objects()ではなく根からたどる
+        RotationCacheに入っている回転画像は別に数える．サブサーフェスは親と画素を共有するので数えない
+        引数 game：実行中のゲーム
+        戻り値：{"surfaces"：回転画像以外のSurfaceの数，"surface_bytes"：その画素メモリ[byte]，
+                 "rotated"：回転画像の数，"rotated_bytes"：その画素メモリ[byte]}の辞書
+        """
+        found: dict[int, pg.Surface] = {}
+        rotated: dict[int, pg.Surface] = {}
+        seen: set[int] = set()
+        stack: list[object] = [globals(), game]
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            if isinstance(obj, RotationCache):
+                rotated.update((id(img), img) for img, _ in obj.cache.values())
+            for ref in gc.get_referents(obj):
+                if isinstance(ref, pg.Surface):
+                    if ref.get_parent() is None:
+                        found[id(ref)] = ref
+                elif id(ref) not in seen and cls.walked(ref):
+                    stack.append(ref)
+        others = [img for key, img in found.items() if key not in rotated]
+        return {"surfaces": len(others), "surface_bytes": sum(img.get_pitch() * img.get_height() for img in others),
+                "rotated": len(rotated), "rotated_bytes": sum(img.get_pitch() * img.get_height() for img in rotated.values())}
+
+    def own(self, stat: tracemalloc.Statistic | tracemalloc.StatisticDiff) -> bool:
+        """
+        行ごとの統計がuntracedのクラスかtracemalloc自身（保存したスナップショット）で確保したメモリならTrueを返す
+        引数 stat：tracemallocの"lineno"の統計
+        戻り値：除く統計ならTrue
+        """
+        frame = stat.traceback[0]
+        return frame.filename == tracemalloc.__file__ or (frame.filename, frame.lineno) in self.excluded
+
+    def sample(self, tick: int, game: "Game") -> dict[str, float]:
+        """
+        今の状態を1行分記録する
+        引数1 tick：開始からの更新回数
+        引数2 game：実行中のゲーム
+        戻り値：記録した行（列名と値の辞書）
+        """
+        snapshot = tracemalloc.take_snapshot()
+        traced = sum(stat.size for stat in snapshot.statistics("lineno") if not self.own(stat))
+        peak = tracemalloc.get_traced_memory()[1]
+        memory = self.surface_memory(game)
+        row = {"tick": tick, "traced_kb": round(traced / 1024, 1), "peak_kb": round(peak / 1024, 1),
+               "objects": len(gc.get_objects()),
+               "surfaces": memory["surfaces"], "surface_kb": round(memory["surface_bytes"] / 1024, 1),
+               "rotated": memory["rotated"], "rotated_kb": round(memory["rotated_bytes"] / 1024, 1)}
+        row.update(game.counts())
+        row.update({f"{name}_free": stats["free"] for name, stats in game.pool_stats().items()})
+        self.samples.append(row)
+        if len(self.samples) == self.warmup + 1:
+            self.baseline = snapshot
+        if self.file is not None:
+            if self.jsonl:
+                self.file.write(json.dumps(row) + "\n")
+            else:
+                if self.writer is None:
+                    self.writer = csv.DictWriter(self.file, fieldnames=list(row), extrasaction="ignore", restval="")
+                    self.writer.writeheader()
+                self.writer.writerow(row)
+            self.file.flush()  # 途中で止めても，そこまでの時系列は残す
+        return row
+
+    def update(self, tick: int, game: "Game"):
+        """
+        interval回の更新ごとに記録する（毎回の更新の後に呼ぶ）
+        引数1 tick：開始からの更新回数
+        引数2 game：実行中のゲーム
+        """
+        if tick % self.interval == 0:
+            self.sample(tick, game)
+
+    def growth(self, tolerance: float = 0.1, monotonic: float = 0.8) -> list[tuple[str, float, float]]:
+        """
+        warmup後の記録で増え続けている項目（リークの疑い）を返す（boundedの列は除く）
+        最初から最後までにtoleranceの割合より多く増え，かつ記録の間の変化のmonotonicの割合以上が減っていないものを選ぶ
+        引数1 tolerance：増加とみなす割合
+        引数2 monotonic：増加とみなす，減っていない変化の割合
+        戻り値：(列名, 最初の値, 最後の値)のリスト
+        """
+        rows = self.samples[self.warmup:]
+        if len(rows) < 3:
+            return []
+        flagged = []
+        for name in rows[0]:
+            if name in self.bounded:
+                continue
+            values = [row[name] for row in rows]
+            first, last = values[0], values[-1]
+            steps = list(zip(values, values[1:]))
+            rising = sum(1 for a, b in steps if b >= a) / len(steps)
+            if last > first * (1 + tolerance) and last - first > 1 and rising >= monotonic:
+                flagged.append((name, first, last))
+        return flagged
+
+    def top_growth(self, limit: int = 5) -> list[str]:
+        """
+        warmup後に確保したまま残っているメモリが多いコードの行を返す
+        引数 limit：返す行の数
+        戻り値：「ファイル:行 増加量」の文字列のリスト
+        """
+        if self.baseline is None:
+            return []
+        diff = [stat for stat in tracemalloc.take_snapshot().compare_to(self.baseline, "lineno") if not self.own(stat)]
+        return [f"{stat.traceback} {stat.size_diff / 1024:+.1f} KB ({stat.count_diff:+d})"
+                for stat in diff[:limit] if stat.size_diff > 0]
+
+    def report(self) -> str:
+        """
+        増え続けている項目と，メモリが増えたコードの行をまとめた文字列を返す
+        戻り値：レポート文字列
+        """
+        lines = [f"memory: {len(self.samples)} samples every {self.interval} ticks"]
+        flagged = self.growth()
+        if not flagged:
+            lines.append("   no monotonic growth")
+        for name, first, last in flagged:
+            lines.append(f"   GROWTH {name:<12}{first:>12} -> {last}")
+        lines += [f"   {line}" for line in self.top_growth()]
+        return "\n".join(lines)
+
+    def close(self):
+        """
+        時系列のファイルを閉じ，自分で開始したtracemallocを止める
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.started and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.started = False
+
+
+class QualityGovernor:
+    """
+    フレーム処理時間を監視し，予算を超え続けたら描画品質を1段階ずつ下げ，
+    余裕が続いたら1段階ずつ戻すクラス（変更はすべてlogに記録し，FrameProfilerのオーバーレイとトレースに出す）
+    """
+    budget_ms = 1000 / FPS  # 1フレームに使える時間[ms]
+
+    def __init__(self, levels: list[dict] = QUALITY_LEVELS, hold: int = 25, recover: int = 150, headroom: float = 0.6):
+        """
+        引数1 levels：描画品質の表
+        引数2 hold：品質を変えた後，次に下げるまで待つフレーム数
+        引数3 recover：品質を1段階戻すのに必要な，余裕のあるフレームの連続数
+        引数4 headroom：平均処理時間が予算のこの割合を下回れば余裕があるとみなす
+        """
+        self.levels = levels
+        self.hold = hold
+        self.recover = recover
+        self.headroom = headroom
+        self.level = 0
+        self.average = 0.0  # フレーム処理時間の指数移動平均[ms]
+        self.wait = 0  # 次に下げられるまでの残りフレーム数
+        self.calm = 0  # 余裕のあるフレームの連続数
+        self.frame = 0
+        self.log: list[tuple[int, int, float]] = []  # (フレーム番号, 変更後の段階, 平均処理時間)
+        self.message = ""  # 直近の変更の説明（FrameProfiler.noteに渡す）
+
+    def observe(self, frame_ms: float, game: "Game") -> bool:
+        """
+        1フレームの処理時間を記録し，必要なら描画品質を変更する
+        引数1 frame_ms：このフレームの処理時間[ms]
+        引数2 game：品質を適用するゲーム
+        戻り値：品質を変更したらTrue
+        """
+        self.frame += 1
+        self.average += (frame_ms - self.average) * 0.1
+        self.wait = max(0, self.wait - 1)
+        self.calm = self.calm + 1 if self.average < self.budget_ms * self.headroom else 0
+        if self.average > self.budget_ms and self.wait == 0 and self.level < len(self.levels) - 1:
+            self.change(self.level + 1, game)
+            return True
+        if self.calm >= self.recover and self.level > 0:
+            self.change(self.level - 1, game)
+            return True
+        return False
+
+    def change(self, level: int, game: "Game"):
+        """
+        描画品質を指定した段階にして，変更を記録する
+        引数1 level：変更後の段階
+        引数2 game：品質を適用するゲーム
+        """
+        old, self.level = self.level, level
+        self.wait = self.hold
+        self.calm = 0
+        game.set_quality(self.levels[level])
+        self.log.append((self.frame, level, self.average))
+        self.message = f"quality {old} -> {level} (avg {self.average:.1f} ms)"
+
+
+class LoadingScreen:
+    """
+    起動時の画像読み込みの進み具合を画面に表示するクラス
+    """
+    def __init__(self, screen: pg.Surface):
+        """
+        引数 screen：画面Surface
+        """
+        self.screen = screen
+        self.font = pg.font.Font(None, 40)
+
+    def draw(self, done: int, total: int, name: str):
+        """
+        読み込みの進み具合のバーを描画して画面に反映する（Assets.load_allのprogressに渡す）
+        引数1 done：読み込み済みの画像の数
+        引数2 total：画像の総数
+        引数3 name：最後に読み込んだ画像名
+        """
+        pg.event.pump()  # 読み込み中もウィンドウが応答しなくならないようにする
+        screen = self.screen
+        screen.fill((0, 0, 0))
+        bar = pg.Rect(0, 0, 400, 20)
+        bar.center = WIDTH // 2, HEIGHT // 2
+        pg.draw.rect(screen, (128, 128, 128), bar)
+        pg.draw.rect(screen, (0, 255, 0), (bar.left, bar.top, bar.width * done // total, bar.height))
+        text = self.font.render(f"Loading... {done}/{total} {name}", True, (255, 255, 255))
+        screen.blit(text, text.get_rect(midbottom=(WIDTH // 2, bar.top - 10)))
+        pg.display.update()
+
+
+class InputRecorder:
+    """
+    シミュレーションの更新1回ごとの入力（マウス位置，キー入力，描画品質の段階）と乱数のシードを
+    固定長のバイナリ形式でファイルに記録するクラス（InputPlayerで再生する）
+    """
+    header = struct.Struct("<4sBQHBd")  # 識別子，形式の版，乱数のシード，FPS，フラグ（bit0：MotionEngine），敵機の分離の強さ
+    record_format = struct.Struct("<hhBBB")  # マウスx，マウスy，スペースキーの回数，Enterキーの回数，描画品質の段階
+    magic = b"KOKA"
+    version = 2
+    keys = (pg.K_SPACE, pg.K_RETURN)  # 記録するキー（Game.updateが使うキー）
+
+    def __init__(self, path: str, seed: int, use_engine: bool = False, separation: float = 0.0):
+        """
+        引数1 path：記録ファイルの出力先
+        引数2 seed：乱数のシード
+        引数3 use_engine：MotionEngineを使っているか（移動計算の結果が変わるため記録する）
+        引数4 separation：FlowFieldの分離の強さ（敵機の動きが変わるため記録する）
+        """
+        self.file = open(path, "wb")
+        self.file.write(__class__.header.pack(__class__.magic, __class__.version, seed, FPS, int(use_engine), separation))
+        self.ticks = 0
+
+    def record(self, mouse_pos: tuple[int, int], events: list[pg.event.Event], quality: int = 0):
+        """
+        更新1回分の入力を書き込む
+        引数1 mouse_pos：マウスの位置座標タプル
+        引数2 events：その更新に渡したイベントのリスト
+        引数3 quality：その更新の時点の描画品質の段階
+        """
+        presses = [sum(1 for event in events if event.type == pg.KEYDOWN and event.key == key) for key in __class__.keys]
+        self.file.write(__class__.record_format.pack(mouse_pos[0], mouse_pos[1], *presses, quality))
+        self.ticks += 1
+
+    def close(self):
+        """
+        記録ファイルを閉じる
+        """
+        self.file.close()
+
+
+class InputPlayer:
+    """
+    InputRecorderの記録ファイルを読み込み，更新1回ごとの入力を返すクラス
+    """
+    def __init__(self, path: str):
+        """
+        引数 path：記録ファイルのパス
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        header = InputRecorder.header
+        magic, version, self.seed, self.fps, flags, self.separation = header.unpack_from(data)
+        if magic != InputRecorder.magic or version != InputRecorder.version:
+            raise ValueError(f"{path}は対応していない形式の記録ファイルです")
+        if self.fps != FPS:
+            raise ValueError(f"{path}はFPS={self.fps}で記録されています（現在はFPS={FPS}）")
+        self.use_engine = bool(flags & 1)
+        body = data[header.size:]
+        size = InputRecorder.record_format.size
+        body = body[:len(body) - len(body) % size]  # 書き込み途中で終了した最後のレコードは捨てる
+        self.records = list(InputRecorder.record_format.iter_unpack(body))
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def tick(self, i: int) -> tuple[tuple[int, int], list[pg.event.Event], int]:
+        """
+        i回目の更新の入力を返す
+        引数 i：更新の番号
+        戻り値：マウスの位置座標タプル，イベントのリスト，描画品質の段階のタプル
+        """
+        x, y, *presses, quality = self.records[i]
+        events = [pg.event.Event(pg.KEYDOWN, key=key) for key, count in zip(InputRecorder.keys, presses) for _ in range(count)]
+        return (x, y), events, quality
+
+
+class RunHistory:
+    """
+    1回のプレイごとの結果（スコア，到達レベル，生存時間，武器ごとの撃破数，フレーム処理時間のパーセンタイル）を
+    SQLiteのファイルに保存し，ランキングと履歴を返すクラス
+    書き込みは別スレッドがキューから取り出してまとめて行うので，記録してもゲームのフレームは止まらない
+    ファイルを開けない（読み取り専用の場所，ロック中，壊れているなど）ときは，何も保存しない空の履歴として動く
+    """
+    columns = ("played_at", "seed", "engine", "outcome", "score", "level", "ticks", "kills", "p50_ms", "p95_ms", "p99_ms")
+
+    def __init__(self, path: str = "koka_history.sqlite3"):
+        """
+        表が無ければ作り，書き込み用のスレッドを開始する（開けなければスレッドは開始しない）
+        引数 path：SQLiteのファイルのパス
+        """
+        self.path = path
+        self.db: sqlite3.Connection | None = None  # 読み出し用（メインスレッド専用，開けなかったときはNone）
+        self.queue: queue.Queue[dict | None] = queue.Queue()
+        self.thread: threading.Thread | None = None
+        db = None
+        try:
+            db = sqlite3.connect(path)
+            with db:
+                db.execute("PRAGMA journal_mode=WAL")  # 書き込み中でも読み出せるようにする
+                db.execute("""CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY, played_at REAL, seed INTEGER, engine INTEGER, outcome TEXT,
+                    score INTEGER, level INTEGER, ticks INTEGER, kills TEXT,
+                    p50_ms REAL, p95_ms REAL, p99_ms REAL)""")
+                db.execute("CREATE INDEX IF NOT EXISTS runs_score ON runs (score DESC, ticks)")
+        except sqlite3.Error as e:  # 履歴が使えなくてもゲームは始める
+            print(f"プレイ履歴のファイルを開けないため，保存しません：{e}", file=sys.stderr)
+            if db is not None:
+                db.close()
+            return
+        self.db = db
+        self.thread = threading.Thread(target=self.write_loop, name="RunHistory", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def percentiles(values, ps: tuple[int, ...] = (50, 95, 99)) -> list[float]:
+        """
+        値の列のパーセンタイル（最近傍の順位）を返す
+        引数1 values：値の列（フレーム処理時間[ms]など）
+        引数2 ps：求めるパーセンタイルのタプル
+        戻り値：psと同じ順のパーセンタイルのリスト（値が無ければ0.0）
+        """
+        ordered = sorted(values)
+        if not ordered:
+            return [0.0] * len(ps)
+        return [round(ordered[min(len(ordered) - 1, len(ordered) * p // 100)], 3) for p in ps]
+
+    def record(self, **run):
+        """
+        1回のプレイの結果を書き込み待ちのキューに入れる（すぐに戻る）
+        引数 run：columnsの列名と値（killsは武器の名前と撃破数の辞書）
+        """
+        if self.thread is None:
+            return
+        run = {name: run.get(name) for name in self.columns}
+        run["kills"] = json.dumps(run["kills"] or {}, sort_keys=True)
+        self.queue.put(run)
+
+    def write_loop(self):
+        """
+        書き込み用のスレッドの処理：キューに溜まった結果を1回のトランザクションでまとめて書き込む
+        """
+        db = sqlite3.connect(self.path)
+        insert = f"INSERT INTO runs ({', '.join(self.columns)}) VALUES ({', '.join(':' + name for name in self.columns)})"
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            running = None not in batch
+            rows = [run for run in batch if run is not None]
+            try:
+                if rows:
+                    with db:
+                        db.executemany(insert, rows)
+            except sqlite3.Error as e:  # 保存に失敗してもゲームは続ける
+                print(f"プレイ履歴を保存できませんでした：{e}", file=sys.stderr)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+        db.close()
+
+    def flush(self):
+        """
+        キューに入れた結果がすべて書き込まれるまで待つ（ランキングを表示する前に呼ぶ）
+        """
+        self.queue.join()
+
+    def query(self, sql: str, params: tuple = ()) -> list[dict]:
+        """
+        SELECT文を実行して，行を列名と値の辞書のリストで返す（killsは辞書に戻す）
+        引数1 sql：SELECT文
+        引数2 params：SQLのパラメータのタプル
+        戻り値：行の辞書のリスト（履歴が使えなければ空のリスト）
+        """
+        if self.db is None:
+            return []
+        cursor = self.db.execute(sql, params)
+        names = [column[0] for column in cursor.description]
+        rows = [dict(zip(names, values)) for values in cursor]
+        for row in rows:
+            if "kills" in row:
+                row["kills"] = json.loads(row["kills"])
+        return rows
+
+    def leaderboard(self, limit: int = 5) -> list[dict]:
+        """
+        スコアの高い順（同点なら早く達成した順）の結果を返す（スコアの索引を使う）
+        引数 limit：返す数
+        戻り値：結果の辞書のリスト
+        """
+        return self.query("SELECT * FROM runs ORDER BY score DESC, ticks LIMIT ?", (limit,))
+
+    def history(self, limit: int = 10) -> list[dict]:
+        """
+        新しい順の結果を返す
+        引数 limit：返す数
+        戻り値：結果の辞書のリスト
+        """
+        return self.query("SELECT * FROM runs ORDER BY id DESC LIMIT ?", (limit,))
+
+    def rank(self, score: int) -> int:
+        """
+        スコアが全体の何位かを返す
+        引数 score：スコア
+        戻り値：順位（1位から）
+        """
+        if self.db is None:
+            return 1
+        return self.db.execute("SELECT COUNT(*) FROM runs WHERE score > ?", (score,)).fetchone()[0] + 1
+
+    def close(self):
+        """
+        残りの結果を書き込んでスレッドを止め，ファイルを閉じる
+        """
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.db is not None:
+            self.db.close()
+
+
+class ResultsScreen:
+    """
+    ゲームオーバー時に今回の結果とランキングを画面中央に表示するクラス
+    """
+    def __init__(self, screen: pg.Surface):
+        """
+        引数 screen：画面Surface
+        """
+        self.screen = screen
+        self.font = pg.font.Font(None, 36)
+
+    def draw(self, run: dict, rank: int, leaders: list[dict]) -> pg.Rect:
+        """
+        今回の結果とランキングの表を描画する
+        引数1 run：今回の結果（RunHistory.recordに渡したもの）
+        引数2 rank：今回のスコアの順位
+        引数3 leaders：RunHistory.leaderboard()の結果
+        戻り値：描画した範囲のRect
+        """
+        kills = " ".join(f"{weapon} {count}" for weapon, count in sorted(run["kills"].items()))
+        lines = [f"Score {run['score']}  Level {run['level']}  {run['ticks'] / FPS:.1f} s  (#{rank})",
+                 f"Kills: {kills or '-'}",
+                 f"Frame ms p50 {run['p50_ms']:.1f} / p95 {run['p95_ms']:.1f} / p99 {run['p99_ms']:.1f}",
+                 "",
+                 "Leaderboard"]
+        lines += [f"{i}. {row['score']:>7}  Lv {row['level']:>3}  {row['ticks'] / FPS:>6.1f} s  "
+                  f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(row['played_at']))}"
+                  for i, row in enumerate(leaders, 1)]
+        panel = pg.Surface((600, 40 + 32 * len(lines)), pg.SRCALPHA)
+        panel.fill((0, 0, 0, 180))
+        for i, text in enumerate(lines):
+            panel.blit(self.font.render(text, True, (255, 255, 255)), (20, 20 + 32 * i))
+        return self.screen.blit(panel, panel.get_rect(center=(WIDTH // 2, HEIGHT // 2)))
+
+
+class Game:
+    """
+    ゲーム1回分の状態（こうかとん，各スプライトグループ，スコア，タイマー）と
+    1フレーム分の進行をまとめたクラス
+    シミュレーションの更新（update，1回でちょうど1/FPS秒進む）と描画（render）は分かれていて，
+    表示ウィンドウ・実際のマウス・フレームレート制限には依存しないので，ヘッドレスでも動かせる
+    """
+    def __init__(self, screen: pg.Surface, use_engine: bool = False, render: bool = True, dirty: bool = True,
+                 background: Background | None = None, separation: float = 0.0):
+        """
+        引数1 screen：描画先のSurface
+        引数2 use_engine：Trueなら移動計算にMotionEngineを使う（NumPyが無ければ無視）
+        引数3 render：Falseなら背景・スプライトの描画を省略する（ロジックだけの計測用）
+        引数4 dirty：Trueなら変化した範囲だけを描き直す差分描画，Falseなら全画面描画
+        引数5 background：背景（Noneなら青空の画像を画面に合わせたもの）
+        引数6 separation：敵機のホーミングの分離の強さ（0なら分離しない）
+        """
+        self.screen = screen
+        self.render = render
+        self.background = Background() if background is None else background
+        self.renderer = DirtyRenderer(screen, self.background, dirty)
+        self.score = Score()
+
+        self.bird = Bird(3, (900, 400))
+        self.hud = Hud(self.bird, self.score)
+        self.bombs = TrackedGroup()
+        self.beams = pg.sprite.Group()
+        self.world = World()  # 爆発などのECSのエンティティ
+        self.emys = TrackedGroup()
+        self.gravities = pg.sprite.Group()
+        self.blades = pg.sprite.Group()  # 回転刃の当たり判定用スプライト
+        self.blade = RollBlade(self.bird, self.blades)  # 回転刃（枚数はこうかとんのレベルで増える）
+        self.lasers = pg.sprite.Group()  # レーザーのグループを追加
+
+        self.grid = SpatialHash()  # 衝突判定用の空間ハッシュ
+        # 頻繁に生成・消滅するスプライトはプールで再利用する
+        self.beam_pool = SpritePool(Beam)
+        self.weapon = NeoBeam(self.bird, self.beams, self.grid, self.beam_pool)  # ビームの発射と移動
+        self.bomb_pool = SpritePool(Bomb)
+        self.waves = WaveScheduler(self.bird, self.emys, self.grid)  # 敵機の出現
+        self.flow = FlowField(separation=separation)  # 敵機のホーミング
+        self.max_exps: int | None = None  # 同時に表示する爆発の上限（Noneなら無制限）
+        self.animate_explosions = True  # Falseなら爆発画像を切り替えない（描画品質を下げたとき）
+        self.rotation_step: float | None = None  # 描画する回転画像の角度の刻み幅（Noneなら既定値．描画品質を下げたとき）
+        self.rewards = KillRewardSystem(self.score, self.bird, self.explode)
+        self.engine = None
+        if use_engine:
+            if np is None:
+                print("NumPyが無いため，MotionEngineを使わずに実行します")
+            else:
+                self.engine = MotionEngine()
+                self.engine.track(self.emys, Enemy, homing=True, cull=False)
+                self.engine.track(self.bombs, Bomb)
+        self.invincible = False  # Trueなら被弾してもゲームオーバーにしない（ベンチマーク用）
+        self.interpolate = False  # Trueなら更新の前に位置を覚え，前回と今回の更新の間の位置を補間して描画する（main()が描画直前の更新でだけ立てる）
+        self.prev_centers: dict[pg.sprite.Sprite, tuple[int, int]] = {}  # 移動前の中心座標
+        self.timer = PhaseTimer()
+        self.tmr = 0  # シミュレーションの更新回数（出現間隔などのタイマーはこれで数える）
+
+    def step(self, mouse_pos: tuple[int, int], events: list[pg.event.Event]) -> bool:
+        """
+        シミュレーションを1回更新して描画する（更新と描画が1対1のヘッドレス実行用）
+        引数1 mouse_pos：マウスの位置座標タプル
+        引数2 events：このフレームに発生したイベントのリスト
+        戻り値：ゲーム続行ならTrue，こうかとんがやられたらFalse
+        """
+        self.timer.start()
+        alive = self.update(mouse_pos, events)
+        if self.render:
+            self.render_frame()
+            self.renderer.flush()  # 転送はしないが，描画した範囲を次のフレームに引き継いで溜めない
+        return alive
+
+    def update(self, mouse_pos: tuple[int, int], events: list[pg.event.Event]) -> bool:
+        """
+        シミュレーションを1/FPS秒分進める
+        引数1 mouse_pos：マウスの位置座標タプル
+        引数2 events：前回の更新以降に発生したイベントのリスト
+        戻り値：ゲーム続行ならTrue，こうかとんがやられたらFalse
+        """
+        bird, score, grid = self.bird, self.score, self.grid
+        emys, beams, bombs = self.emys, self.beams, self.bombs
+        gravities, blades, lasers = self.gravities, self.blades, self.lasers
+        tmr = self.tmr
+
+        grid.begin_frame()  # このフレームのグリッドを作り直す（照準と衝突判定で共有）
         if tmr % 100 == 0:
-            if emys:  # 敵が存在する場合
-                # 最も近い敵を選択
-                nearest_enemy = min(emys, key=lambda emy: math.hypot(bird.rect.centerx - emy.rect.centerx, bird.rect.centery - emy.rect.centery))
+            # 最も近い敵を選択
+            for nearest_enemy in grid.nearest(emys, bird.rect.center):
                 # 最も近い敵の方向にビームを発射
-                beams.add(Beam(bird, nearest_enemy.rect))
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                return 0
-        mouse_pos = pg.mouse.get_pos()
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                return 0
+                self.weapon.fire(nearest_enemy.rect, 1)
+        for event in events:
             if event.type == pg.KEYDOWN and event.key == pg.K_SPACE:
-                if emys:
-                    nearest_enemy = min(emys, key=lambda emy: math.hypot(bird.rect.centerx - emy.rect.centerx, bird.rect.centery - emy.rect.centery))
-                    beams.add(Beam(bird, nearest_enemy.rect))
+                for nearest_enemy in grid.nearest(emys, bird.rect.center):
+                    self.weapon.fire(nearest_enemy.rect)  # 最も近い敵を中心に扇形に発射
             if event.type == pg.KEYDOWN and event.key == pg.K_RETURN:
                 if score.value >= 200:
                     gravities.add(Gravity(400))
                     score.value -= 200
+        self.timer.mark("input")
 
-        screen.blit(scaled_bg_img, [0, 0])
-        if tmr % 100 == 0:  # 200フレームに1回，敵機を出現させる
-            emys.add(Enemy(bird))  # 鳥のインスタンスを渡す
+        self.waves.update(tmr)  # ウェーブの表に従って敵機を出現させる
         if tmr%500 == 0:  #500フレームに1回攻撃を出現させる。
-            beams.add(Laser(bird))
+            lasers.add(Laser(bird))
+        self.timer.mark("spawn")
+
+        # 倒した敵機・爆弾を(倒された側, 倒した武器のDamage)として集め，報酬はKillRewardSystemでまとめて与える
+        kills = [(emy, Beam.damage) for emy in grid.groupcollide(emys, beams, True, True)]
+        kills += [(bomb, Beam.damage) for bomb in grid.groupcollide(bombs, beams, True, True)]
 
-        for emy in pg.sprite.groupcollide(emys, beams, True, True).keys():
-            exps.add(Explosion(emy, 100))  # 爆発エフェクト
-            score.value += 10  # 10点アップ
-            bird.change_img(6, screen)  # こうかとん喜びエフェクト
-            bird.gain_experience(10)  # 経験値を獲得
+        if len(grid.spritecollide(bird, bombs, True)) != 0:
+            bird.change_img(8)  # こうかとん悲しみエフェクト
 
-        for bomb in pg.sprite.groupcollide(bombs, beams, True, True).keys():
-            exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-            score.value += 1  # 1点アップ
-            bird.gain_experience(5)  # 経験値を獲得
+        kills += [(emy, RollBlade.damage) for emy in grid.groupcollide(emys, blades, True, False)]
+        kills += [(bomb, RollBlade.damage) for bomb in grid.groupcollide(bombs, blades, True, False)]
+        self.rewards.run(kills)
 
-        if len(pg.sprite.spritecollide(bird, bombs, True)) != 0:
-            bird.change_img(8, screen)  # こうかとん悲しみエフェクト
+        if len(grid.spritecollide(bird, bombs, True)) != 0 and not self.invincible:
+            bird.change_img(8)
+            self.game_over()
+            return False
 
+        if len(grid.spritecollide(bird, emys, True)) != 0 and not self.invincible:
+            bird.change_img(8)  # こうかとん悲しみエフェクト
+            self.game_over()
+            return False
         
+        kills = []
+        for gravity in gravities:
+            kills += [(bomb, gravity.damage) for bomb in grid.areacollide(gravity.rect, gravity.hit, bombs, True)]
+            kills += [(emy, gravity.damage) for emy in grid.areacollide(gravity.rect, gravity.hit, emys, True)]
+
+        for laser in lasers:
+            kills += [(emy, laser.damage) for emy in grid.areacollide(laser.rect, laser.hit, emys, True)]
+            kills += [(bomb, laser.damage) for bomb in grid.areacollide(laser.rect, laser.hit, bombs, True)]
+        self.rewards.run(kills)
+        self.timer.mark("collision")
+
+        if self.interpolate:  # 補間描画のために移動前の位置を覚えておく
+            self.prev_centers = {sprite: sprite.rect.center for group in (emys, beams, bombs) for sprite in group}
+            self.prev_centers[bird] = bird.rect.center
+        bird.update(mouse_pos)
+        self.weapon.update()  # ビームはバッチでまとめて移動
+        if self.engine is not None:
+            self.engine.step(bird.rect.center)  # 敵機・爆弾の移動をまとめて計算
+        else:
+            self.flow.update(bird.rect.center, tmr)
+            self.flow.move(emys)  # 敵機はフローフィールドに沿って移動
+            bombs.update()
+        lasers.update()  # レーザーの更新を追加
+        LifetimeSystem.run(self.world)  # 爆発の寿命
+        gravities.update()
+        self.blade.update()
+        self.background.update()
+        self.timer.mark("update")
+        self.tmr += 1
+        return True
 
-        for emy in pg.sprite.groupcollide(emys, blades, True, False).keys():
-            exps.add(Explosion(emy, 100))
-            score.value += 10
-            bird.change_img(6, screen)
-            bird.gain_experience(10) 
+    def explode(self, obj: pg.sprite.Sprite, life: int):
+        """
+        爆発エフェクトを出す（表示中の爆発が上限に達していれば出さない）
+        引数1 obj：爆発するスプライト
+        引数2 life：爆発時間
+        """
+        if self.max_exps is None or self.world.count(Appearance) < self.max_exps:
+            Explosion.create(self.world, obj, life)
 
-        for bomb in pg.sprite.groupcollide(bombs, blades, True, False).keys():
-            exps.add(Explosion(bomb, 50))
-            score.value += 1
-            bird.gain_experience(5) 
+    def set_quality(self, quality: dict):
+        """
+        描画品質を適用する（QUALITY_LEVELSの1行）
+        引数 quality：描画品質の設定の辞書
+        """
+        # 回転画像の刻み幅は描画だけに使い，共有の回転キャッシュと当たり判定のrectは変えない
+        step = quality["rotation_step"]
+        self.rotation_step = None if step == ROTATION_STEP else step
+        self.bird.draw_step = self.blade.draw_step = self.rotation_step
+        self.blade.stride = quality["blade_stride"]
+        self.animate_explosions = quality["animate_explosions"]
+        self.max_exps = quality["max_explosions"]
+
+    def render_frame(self, alpha: float = 1.0):
+        """
+        背景を戻してから全体を描画する
+        引数 alpha：前回から今回の更新位置への補間の割合（1.0なら今回の位置）
+        """
+        self.renderer.begin()
+        self.timer.mark("background")
+        self.draw(alpha)
+        self.timer.mark("draw")
 
+    def draw(self, alpha: float = 1.0):
+        """
+        全スプライトとHUDを決まった重なり順で1回ずつ描画し，描画範囲を登録する
+        奥から：こうかとん，敵機，レーザー，爆弾，爆発，回転刃，重力場，ビーム，HUD
+        引数 alpha：前回から今回の更新位置への補間の割合（1.0なら今回の位置）
+        """
+        screen, renderer = self.screen, self.renderer
+        prev = self.prev_centers if self.interpolate and alpha < 1.0 else None
+        offset = (0, 0)
+        if prev is not None and self.bird in prev:
+            old, back = prev[self.bird], 1.0 - alpha
+            offset = (round((old[0] - self.bird.rect.centerx) * back), round((old[1] - self.bird.rect.centery) * back))
+        renderer.add(self.bird.draw(screen, offset))
+        renderer.blit_group(self.emys, prev, alpha)
+        for laser in self.lasers:  # レーザーの描画を追加
+            renderer.add(laser.draw(screen))
+        renderer.blit_group(self.bombs, prev, alpha)
+        renderer.add(AppearanceSystem.draw(self.world, screen, self.animate_explosions))
+        renderer.add(self.blade.draw(screen, offset))
+        renderer.blit_group(self.gravities)
+        if self.rotation_step is None:
+            renderer.blit_group(self.beams, prev, alpha)
+        else:
+            renderer.blit_group(self.beams, prev, alpha, Assets.rotations("beam", 2.0), self.rotation_step)
+        renderer.add(self.hud.draw(screen))
 
-        if len(pg.sprite.spritecollide(bird, bombs, True)) != 0:
-            bird.change_img(8, screen)
-            score.update(screen)
-            pg.display.update()
-            time.sleep(2)
-            return
+    def game_over(self):
+        """
+        こうかとんがやられた時の処理（最終フレームは画面全体を転送する）
+        """
+        self.timer.mark("collision")
+        self.prev_centers = {}
+        self.renderer.full = True
 
-        if len(pg.sprite.spritecollide(bird, emys, True)) != 0:
-            bird.change_img(8, screen)  # こうかとん悲しみエフェクト
-            score.update(screen)
-            pg.display.update()
-            time.sleep(2)
-            return
-        
-        if len(pg.sprite.spritecollide(bird, emys, True)) != 0:
-            bird.change_img(8, screen)  # こうかとん悲しみエフェクト
-            score.update(screen)
-            pg.display.update()
-            time.sleep(2)
-            return
-        
-        if len(pg.sprite.spritecollide(bird, emys, True)) != 0:
-            bird.change_img(8, screen) # こうかとん悲しみエフェクト
-            score.update(screen)
-            pg.display.update()
-            time.sleep(2)
-            return
-        
-        for gravity in gravities:
-            for bomb in pg.sprite.spritecollide(gravity, bombs, True):
-                exps.add(Explosion(bomb, 50))
-                score.value += 1
-                bird.gain_experience(5)  # 経験値を獲得
-
-            for bomb in pg.sprite.spritecollide(gravity, emys, True):
-                exps.add(Explosion(bomb, 50))
-                score.value += 10
-                bird.gain_experience(10)  # 経験値を獲得
-
-        for laser in pg.sprite.groupcollide(lasers, emys, False, True).keys():
-            exps.add(Explosion(laser, 100))  # 爆発エフェクト
-            score.value += 10  # 10点アップ
-
-        for laser in pg.sprite.groupcollide(lasers, bombs, False, True).keys():
-            exps.add(Explosion(laser, 50))  # 爆発エフェクト
-            score.value += 1  # 1点アップ
-        
-        bird.update(mouse_pos, screen)
-        beams.update()
-        beams.draw(screen)
-        emys.update()
-        emys.draw(screen)
-        lasers.update()  # レーザーの更新を追加     
-        lasers.draw(screen)  # レーザーの描画を追加
-        bombs.update()
-        bombs.draw(screen)
-        exps.update()
-        exps.draw(screen)
-        gravities.update()
-        gravities.draw(screen)
-        blades.update()
-        blades.draw(screen)
-        for blade in blades:
-            blade.draw(screen)
-        gravities.draw(screen)  
-        score.update(screen)
-        beams.draw(screen)
-        score.update(screen)
-        pg.display.update()
-        tmr += 1
-        clock.tick(50)
+    def summary(self) -> dict:
+        """
+        ここまでのプレイの結果を返す
+        戻り値：スコア，レベル，生存時間[更新回数]，武器ごとの撃破数の辞書
+        """
+        return {"score": self.score.value, "level": self.bird.level, "ticks": self.tmr, "kills": dict(self.rewards.kills)}
 
+    def pool_stats(self) -> dict[str, dict[str, int]]:
+        """
+        スプライトプールごとの統計を返す
+        戻り値：プール名と統計の辞書
+        """
+        return {
+            "beam": self.beam_pool.stats(),
+            "bomb": self.bomb_pool.stats(),
+            "explosion": self.world.entities.stats(),  # ECSのエンティティは爆発だけ
+            "enemy": self.waves.pool.stats(),
+        }
+
+    def counts(self) -> dict[str, int]:
+        """
+        グループごとのスプライト数を返す
+        戻り値：グループ名とスプライト数の辞書
+        """
+        return {
+            "emys": len(self.emys),
+            "beams": len(self.beams),
+            "bombs": len(self.bombs),
+            "exps": self.world.count(Appearance),
+            "gravities": len(self.gravities),
+            "lasers": len(self.lasers),
+        }
+
+
+def main():
+    pg.display.set_caption("真！こうかとん無双")
+    screen = pg.display.set_mode((WIDTH, HEIGHT))
+    # 画像はここで並列に一括読み込みし，ループ中は読み込まない
+    load_start = time.perf_counter()
+    Assets.load_all(progress=LoadingScreen(screen).draw)
+    load_ms = (time.perf_counter() - load_start) * 1000
+    if os.environ.get("KOKA_ASSET_REPORT"):
+        print(Assets.report())
+    # 乱数のシード（環境変数KOKA_SEEDで固定できる）．KOKA_RECORD=ファイル名で入力を記録し，koka_replay.pyで再生する
+    seed = int(os.environ.get("KOKA_SEED", time.time_ns() % 2**32))
+    random.seed(seed)
+    use_engine = os.environ.get("KOKA_ENGINE") == "numpy"
+    separation = float(os.environ.get("KOKA_SEPARATION", "0"))  # 敵機の分離の強さ（0なら分離しない）
+    recorder = InputRecorder(os.environ["KOKA_RECORD"], seed, use_engine, separation) if os.environ.get("KOKA_RECORD") else None
+    # 環境変数KOKA_BG_SCROLL=dx,dyで背景を更新1回あたり(dx, dy)px敷き詰めてスクロールさせる
+    scroll = tuple(float(v) for v in os.environ.get("KOKA_BG_SCROLL", "0,0").split(","))
+    background = Background(mode="tile", scroll=scroll, tile_scale=0.7) if scroll != (0, 0) else Background()
+    # 環境変数KOKA_ENGINE=numpyで移動計算をMotionEngineにまとめ，KOKA_FULL_REDRAW=1で全画面描画にする
+    game = Game(screen, use_engine=use_engine, dirty=not os.environ.get("KOKA_FULL_REDRAW"), background=background,
+                separation=separation)
+    # 環境変数KOKA_PROFILE=1かF3キーで処理時間のオーバーレイを表示，KOKA_TRACE=ファイル名でトレースを出力
+    profiler = FrameProfiler(trace_path=os.environ.get("KOKA_TRACE"))
+    profiler.enabled = bool(os.environ.get("KOKA_PROFILE"))
+    # 環境変数KOKA_MEMORY=ファイル名で，KOKA_MEMORY_EVERY回（既定500回）の更新ごとにメモリの時系列を出力する
+    telemetry = None
+    if os.environ.get("KOKA_MEMORY"):
+        telemetry = MemoryTelemetry(os.environ["KOKA_MEMORY"], int(os.environ.get("KOKA_MEMORY_EVERY", "500")))
+    # プレイの結果を環境変数KOKA_HISTORYのファイル（既定はkoka_history.sqlite3，空なら保存しない）に保存する
+    history_path = os.environ.get("KOKA_HISTORY", "koka_history.sqlite3")
+    history = RunHistory(history_path) if history_path else None
+    frame_times = array("f")  # フレーム処理時間[ms]（結果のパーセンタイル用）
+
+    def save_run(outcome: str) -> dict | None:
+        """
+        プレイの結果を履歴に記録する（書き込みは別スレッド）
+        引数 outcome：終わり方（"game over"か"quit"）
+        戻り値：記録した結果（履歴に保存しないならNone）
+        """
+        if history is None:
+            return None
+        run = {**game.summary(), "played_at": time.time(), "seed": seed, "engine": use_engine, "outcome": outcome}
+        run["p50_ms"], run["p95_ms"], run["p99_ms"] = RunHistory.percentiles(frame_times)
+        history.record(**run)
+        return run
+
+    # 環境変数KOKA_QUALITY=0で描画品質の自動調整を止める
+    governor = QualityGovernor() if os.environ.get("KOKA_QUALITY", "1") != "0" else None
+    # 描画のフレームレート上限（環境変数KOKA_RENDER_FPS，既定は2*FPS，0なら無制限）．シミュレーションは常にFPS回/秒
+    render_fps = int(os.environ.get("KOKA_RENDER_FPS", 2 * FPS))
+    interpolate = render_fps != FPS  # 更新と描画の回数が一致しないときだけ位置を補間する
+    clock = pg.time.Clock()
+    sim_dt = 1 / FPS
+    accumulator = 0.0  # まだシミュレーションに反映していない実時間[秒]
+    pending: list[pg.event.Event] = []  # まだシミュレーションに渡していないイベント
+    frame = 0
+    last = time.perf_counter()
+
+    try:
+        while True:
+            frame_start = time.perf_counter()
+            accumulator += frame_start - last
+            last = frame_start
+            game.timer.start()
+            events = pg.event.get()
+            for event in events:
+                if event.type == pg.QUIT:
+                    save_run("quit")
+                    return 0
+                if event.type == pg.KEYDOWN and event.key == pg.K_F3:
+                    profiler.enabled = not profiler.enabled
+            pending.extend(events)
+            mouse_pos = pg.mouse.get_pos()
+            ticks = 0
+            while accumulator >= sim_dt:
+                if ticks == MAX_TICKS:  # 追いつけない分の時間は捨てる
+                    accumulator %= sim_dt
+                    break
+                if recorder is not None:
+                    recorder.record(mouse_pos, pending, governor.level if governor is not None else 0)
+                # 移動前の位置は，このフレームの描画の直前になる最後の更新でだけ覚える
+                game.interpolate = interpolate and (accumulator < 2 * sim_dt or ticks == MAX_TICKS - 1)
+                alive = game.update(mouse_pos, pending)
+                pending = []
+                if telemetry is not None:
+                    telemetry.update(game.tmr, game)
+                accumulator -= sim_dt
+                ticks += 1
+                if not alive:
+                    game.render_frame()
+                    run = save_run("game over")
+                    if run is not None:
+                        history.flush()  # 今回の結果もランキングに入れる
+                        ResultsScreen(screen).draw(run, history.rank(run["score"]), history.leaderboard())
+                    pg.display.update()
+                    time.sleep(2)
+                    return
+            game.render_frame(min(accumulator / sim_dt, 1.0))
+            if profiler.enabled:
+                game.renderer.add(profiler.draw(screen))
+                game.timer.mark("overlay")
+            dirty = game.renderer.flush()
+            if dirty is None:
+                pg.display.update()
+            else:
+                pg.display.update(dirty)
+            game.timer.mark("display")
+            frame_ms = (time.perf_counter() - frame_start) * 1000
+            frame_times.append(frame_ms)
+            if frame == 0:
+                print(f"起動から最初のフレームまで {(time.perf_counter() - LAUNCH_TIME) * 1000:.0f} ms（画像の読み込み {load_ms:.0f} ms）")
+            if governor is not None and governor.observe(frame_ms, game):
+                profiler.note(governor.message)  # 品質の変更はオーバーレイとトレースに出す
+            if profiler.active:
+                profiler.record(frame, game.timer.times, game.counts(), frame_ms)
+            frame += 1
+            clock.tick(render_fps)
+    finally:
+        profiler.close()
+        if recorder is not None:
+            recorder.close()
+        if telemetry is not None:
+            print(telemetry.report())
+            telemetry.close()
+        if history is not None:
+            history.close()
 
 
 if __name__ == "__main__":
@@ -620,4 +3318,3 @@ if __name__ == "__main__":
     main()
     pg.quit()
     sys.exit()
-
@@ -0,0 +1,157 @@
+"""
+こうかとん無双のルールのパラメータを総当たりで変え，乱数のシードごとのヘッドレス実行を
+CPUコアの数だけ並列に行って，生存時間・スコア・レベルの推移を集計したCSVを出力するバランス調整ツール
+使い方：python koka_sweep.py spawn_scale=0.5,1,2 bird_speed=4,6 blades=1,3 exp=50/100,30/60
+        [--seeds N] [--frames N] [--policy circle|evade] [--workers N] [--out sweep.csv]
+"""
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # pygameの初期化より前に設定する
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+import argparse
+import csv
+import itertools
+import math
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import koka_bench as kb
+import koka_survivor as ks
+
+
+def evade_policy(frame: int, game: ks.Game) -> tuple[int, int]:
+    """
+    最も近い敵機から遠ざかる方向にマウスを置く操作スクリプト（敵がいなければ画面中央に戻る）
+    引数1 frame：経過フレーム数
+    引数2 game：実行中のゲーム
+    戻り値：マウスの位置座標タプル
+    """
+    x, y = game.bird.rect.center
+    nearest = min(game.emys, key=lambda emy: math.dist(emy.rect.center, (x, y)), default=None)
+    if nearest is None:
+        return ks.WIDTH // 2, ks.HEIGHT // 2
+    dx, dy = x - nearest.rect.centerx, y - nearest.rect.centery
+    norm = math.hypot(dx, dy) or 1
+    # 画面の端に追い詰められないよう，中央へ戻る向きも少し混ぜる
+    tx = x + 150 * dx / norm + 0.3 * (ks.WIDTH / 2 - x)
+    ty = y + 150 * dy / norm + 0.3 * (ks.HEIGHT / 2 - y)
+    return int(min(max(tx, 0), ks.WIDTH - 1)), int(min(max(ty, 0), ks.HEIGHT - 1))
+
+
+POLICIES = {"circle": kb.circle_policy, "evade": evade_policy}
+
+
+def parse_value(name: str, text: str):
+    """
+    パラメータの値の文字列を変換する
+    引数1 name：パラメータ名
+    引数2 text：値の文字列
+    戻り値：expなら経験値のリスト（/区切り），それ以外は数値
+    """
+    if name == "exp":
+        return [int(v) for v in text.split("/")]
+    return float(text) if "." in text else int(text)
+
+
+# パラメータ名と，ゲームのルールへの反映方法の辞書
+# spawn_scale：敵機の出現間隔の倍率，bird_speed：こうかとんの速さ，blades：回転刃の枚数（レベルで増やさない），
+# exp：レベルごとの次のレベルまでの経験値（/区切り）
+APPLY = {
+    "spawn_scale": lambda game, v: setattr(game.waves, "waves",
+                                           [dict(row, interval=max(1, round(row["interval"] * v))) for row in game.waves.waves]),
+    "bird_speed": lambda game, v: setattr(game.bird, "speed", v),
+    "blades": lambda game, v: (setattr(game.blade, "levels", [(1, v)]), game.blade.set_count(v)),
+    "exp": lambda game, v: (setattr(game.bird, "exp_thresholds", v), setattr(game.bird, "exp_to_next_level", v[0])),
+}
+
+
+def run_one(job: tuple[dict, int, int, str, int]) -> dict:
+    """
+    1つの設定・1つのシードでヘッドレス実行する（ワーカープロセスで呼ばれる）
+    引数 job：(パラメータの辞書, シード, 最大フレーム数, 操作スクリプト名, 記録間隔)のタプル
+    戻り値：run_headless()の結果にパラメータとシードを加えた辞書
+    """
+    params, seed, frames, policy, sample_every = job
+
+    def setup(game: ks.Game):
+        for name, value in params.items():
+            APPLY[name](game, value)
+
+    result = kb.run_headless(frames, seed=seed, policy=POLICIES[policy], sample_every=sample_every, setup=setup)
+    result.update(params=params, seed=seed)
+    return result
+
+
+def aggregate(params: dict, results: list[dict], frames: int, sample_every: int) -> dict:
+    """
+    同じ設定の全シードの結果をCSVの1行にまとめる
+    引数1 params：パラメータの辞書
+    引数2 results：その設定のrun_one()の結果のリスト
+    引数3 frames：最大フレーム数
+    引数4 sample_every：記録間隔[フレーム]
+    戻り値：CSVの1行の辞書
+    """
+    survival = [r["frames"] / ks.FPS for r in results]
+    row = {name: "/".join(map(str, v)) if isinstance(v, list) else v for name, v in params.items()}
+    row.update({
+        "runs": len(results),
+        "survival_mean_s": round(sum(survival) / len(survival), 2),
+        "survival_min_s": round(min(survival), 2),
+        "survived_rate": round(sum(r["survived"] for r in results) / len(results), 3),
+        "score_mean": round(sum(r["score"] for r in results) / len(results), 1),
+        "level_mean": round(sum(r["level"] for r in results) / len(results), 2),
+    })
+    # レベルの推移：記録した時点ごとの平均（やられた後はやられた時のレベルのまま数える）
+    for frame in range(sample_every, frames + 1, sample_every):
+        levels = []
+        for r in results:
+            level = 1
+            for sample_frame, sample in r["samples"]:
+                if sample_frame > frame:
+                    break
+                level = sample["level"]
+            levels.append(r["level"] if r["frames"] < frame else level)
+        row[f"level_{frame / ks.FPS:g}s"] = round(sum(levels) / len(levels), 2)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="こうかとん無双のバランス調整用の並列シミュレーション")
+    parser.add_argument("grid", nargs="*", help=f"名前=値,値,...（{', '.join(APPLY)}）．省略時は現在のルールのみ")
+    parser.add_argument("--seeds", type=int, default=8, help="設定ごとの実行回数（シード0からN-1）")
+    parser.add_argument("--frames", type=int, default=3000, help="1回の実行の最大フレーム数")
+    parser.add_argument("--policy", default="evade", help=f"操作スクリプト（{', '.join(POLICIES)}）")
+    parser.add_argument("--sample-every", type=int, default=500, help="レベルの推移を記録する間隔[フレーム]")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="並列に動かすプロセス数")
+    parser.add_argument("--out", default="sweep.csv", help="集計結果のCSVの出力先（-なら標準出力）")
+    args = parser.parse_args()
+    if args.policy not in POLICIES:
+        parser.error(f"未知の操作スクリプト：{args.policy}")
+    axes = {}
+    for item in args.grid:
+        name, _, values = item.partition("=")
+        if name not in APPLY or not values:
+            parser.error(f"パラメータの指定が不正です：{item}")
+        axes[name] = [parse_value(name, v) for v in values.split(",")]
+
+    configs = [dict(zip(axes, combo)) for combo in itertools.product(*axes.values())]
+    jobs = [(params, seed, args.frames, args.policy, args.sample_every) for params in configs for seed in range(args.seeds)]
+    print(f"{len(configs)}通りの設定 x {args.seeds}シード = {len(jobs)}回を{args.workers}プロセスで実行します", file=sys.stderr)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(run_one, jobs, chunksize=max(1, len(jobs) // (4 * args.workers))))
+    print(f"{time.perf_counter() - start:.1f} 秒で完了", file=sys.stderr)
+
+    rows = [aggregate(params, results[i * args.seeds:(i + 1) * args.seeds], args.frames, args.sample_every)
+            for i, params in enumerate(configs)]
+    out = sys.stdout if args.out == "-" else open(args.out, "w", newline="")
+    try:
+        writer = csv.DictWriter(out, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()